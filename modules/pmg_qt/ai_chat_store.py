@@ -315,7 +315,8 @@ class AiChatStore:
             role = getattr(role, "value", role)
             text = getattr(event, "text", "")
             ok = getattr(event, "ok", None)
-            metadata = getattr(event, "metadata", {}) or {}
+            # UiEvent metadata is a read-only mapping; persist a plain dict.
+            metadata = dict(getattr(event, "metadata", None) or {})
             ts = self._now_iso()
 
         try:
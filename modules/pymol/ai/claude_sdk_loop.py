@@ -9,6 +9,8 @@ import uuid
 from dataclasses import dataclass
 from typing import Any, Callable, Dict, Optional, Tuple
 
+_RE_CD_TARGET = re.compile(r"(?:^|&&|\|\||;)\s*cd\s+([^;&|]+)")
+
 
 class ClaudeSdkLoopError(RuntimeError):
     def __init__(self, message: str, *, error_class: str = "sdk_error"):
@@ -142,6 +144,12 @@ def _assistant_block_type(block: Any) -> str:
     return ""
 
 
+def _dumps_text(payload: Any) -> str:
+    # Same compact text as json_codec.dumps without orjson; this module stays
+    # importable on its own, so it does not import the package codec.
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
 def _as_json_dict(text: str) -> Dict[str, Any]:
     raw = str(text or "").strip()
     if not raw:
@@ -155,6 +163,18 @@ def _as_json_dict(text: str) -> Dict[str, Any]:
     return {}
 
 
+def _known_tool_input(entry: Dict[str, Any]) -> Dict[str, Any]:
+    # Streamed tool input is kept as raw JSON until a result needs it; the
+    # AssistantMessage normally replaces it with the SDK's parsed dict first.
+    value = entry.get("input")
+    if isinstance(value, dict):
+        return value
+    parsed = _as_json_dict(value) if isinstance(value, str) else {}
+    if entry:
+        entry["input"] = parsed
+    return parsed
+
+
 def _safe_realpath(base: str, value: str) -> str:
     text = str(value or "").strip()
     if not text:
@@ -173,9 +193,8 @@ def _is_within_root(path: str, root: str) -> bool:
 
 def _extract_cd_targets(command: str) -> list[str]:
     # Best-effort scan for "cd <path>" across shell command chains.
-    pattern = re.compile(r"(?:^|&&|\|\||;)\s*cd\s+([^;&|]+)")
     targets = []
-    for match in pattern.finditer(str(command or "")):
+    for match in _RE_CD_TARGET.finditer(str(command or "")):
         target = match.group(1).strip().strip("\"'`")
         if target:
             targets.append(target)
@@ -297,8 +316,9 @@ OPENBIO_GATEWAY_TOOL_SPECS = (
 class ClaudeSdkLoop:
     SERVER_NAME = "pymol_tools"
 
-    def __init__(self, logger: Optional[Callable[..., None]] = None):
+    def __init__(self, logger: Optional[Callable[..., None]] = None, *, auth_token: Optional[str] = None):
         self._log_fn = logger
+        self._auth_token = auth_token or ""
         self._logger = logging.getLogger("pymol.ai.sdk")
         self._trace_stream = os.getenv("PYMOL_AI_TRACE_STREAM", "0") == "1"
 
@@ -323,10 +343,11 @@ class ClaudeSdkLoop:
             or os.getenv("OPENROUTER_BASE_URL")
             or "https://openrouter.ai/api"
         )
-        token = os.getenv("ANTHROPIC_AUTH_TOKEN") or os.getenv("OPENROUTER_API_KEY") or ""
+        token = self._auth_token or os.getenv("ANTHROPIC_AUTH_TOKEN") or os.getenv("OPENROUTER_API_KEY") or ""
 
         os.environ.setdefault("ANTHROPIC_BASE_URL", base)
-        if token:
+        # An explicit token reaches the SDK through options.env only.
+        if token and not self._auth_token:
             os.environ.setdefault("ANTHROPIC_AUTH_TOKEN", token)
         os.environ.setdefault("ANTHROPIC_API_KEY", "")
         self._log(
@@ -367,7 +388,7 @@ class ClaudeSdkLoop:
                 "content": [
                     {
                         "type": "text",
-                        "text": json.dumps(payload, ensure_ascii=False),
+                        "text": _dumps_text(payload),
                     }
                 ]
             }
@@ -388,7 +409,7 @@ class ClaudeSdkLoop:
             content = [
                 {
                     "type": "text",
-                    "text": json.dumps(payload, ensure_ascii=False),
+                    "text": _dumps_text(payload),
                 }
             ]
             image_data, mime_type = _decode_data_url_image(str(image_data_url or ""))
@@ -420,7 +441,7 @@ class ClaudeSdkLoop:
                             "content": [
                                 {
                                     "type": "text",
-                                    "text": json.dumps(payload, ensure_ascii=False),
+                                    "text": _dumps_text(payload),
                                 }
                             ]
                         }
@@ -559,7 +580,8 @@ class ClaudeSdkLoop:
         in_tool_use_block = False
         active_tool_use_id = ""
         active_tool_use_name = ""
-        active_tool_input_json = ""
+        # input_json_delta fragments, joined once when the tool_use block closes.
+        active_tool_input_parts: list[str] = []
         known_tool_uses: Dict[str, Dict[str, Any]] = {}
         reported_tool_result_ids = set()
 
@@ -595,7 +617,7 @@ class ClaudeSdkLoop:
                             in_tool_use_block = True
                             active_tool_use_id = str(block_data.get("id") or "")
                             active_tool_use_name = str(block_data.get("name") or "")
-                            active_tool_input_json = ""
+                            active_tool_input_parts = []
                             if active_tool_use_id:
                                 known_tool_uses[active_tool_use_id] = {
                                     "name": active_tool_use_name,
@@ -617,15 +639,16 @@ class ClaudeSdkLoop:
 
                     if event_type == "content_block_stop":
                         if in_tool_use_block:
+                            active_tool_input_json = "".join(active_tool_input_parts)
                             if active_tool_use_id and active_tool_input_json.strip():
                                 known_tool_uses[active_tool_use_id] = {
                                     "name": active_tool_use_name,
-                                    "input": _as_json_dict(active_tool_input_json),
+                                    "input": active_tool_input_json,
                                 }
                             in_tool_use_block = False
                             active_tool_use_id = ""
                             active_tool_use_name = ""
-                            active_tool_input_json = ""
+                            active_tool_input_parts = []
                             if self._trace_stream:
                                 self._log("sdk tool_use block ended", level="DEBUG")
                         continue
@@ -634,7 +657,7 @@ class ClaudeSdkLoop:
                         if delta_type == "input_json_delta":
                             fragment = str(delta_data.get("partial_json") or delta_data.get("text") or "")
                             if fragment:
-                                active_tool_input_json += fragment
+                                active_tool_input_parts.append(fragment)
 
                     text, reasoning = _extract_stream_chunks(message)
                     if text:
@@ -679,9 +702,7 @@ class ClaudeSdkLoop:
                             reported_tool_result_ids.add(tool_use_id)
                             parent = known_tool_uses.get(tool_use_id) or {}
                             parent_name = str(parent.get("name") or "")
-                            parent_input = parent.get("input")
-                            if not isinstance(parent_input, dict):
-                                parent_input = {}
+                            parent_input = _known_tool_input(parent)
                             if on_tool_result:
                                 on_tool_result(
                                     tool_use_id,
@@ -714,9 +735,7 @@ class ClaudeSdkLoop:
                     if parent_tool_use_id and parent_tool_use_id not in reported_tool_result_ids:
                         parent = known_tool_uses.get(parent_tool_use_id) or {}
                         parent_name = str(parent.get("name") or "")
-                        parent_input = parent.get("input")
-                        if not isinstance(parent_input, dict):
-                            parent_input = {}
+                        parent_input = _known_tool_input(parent)
                         if on_tool_result:
                             on_tool_result(
                                 parent_tool_use_id,
@@ -738,9 +757,7 @@ class ClaudeSdkLoop:
                             continue
                         parent = known_tool_uses.get(tool_use_id) or {}
                         parent_name = str(parent.get("name") or "")
-                        parent_input = parent.get("input")
-                        if not isinstance(parent_input, dict):
-                            parent_input = {}
+                        parent_input = _known_tool_input(parent)
                         if on_tool_result:
                             on_tool_result(
                                 tool_use_id,
@@ -5,6 +5,7 @@ import re
 
 _RE_ASSIGNMENT = re.compile(r"^[A-Za-z_]\w*\s*=")
 _RE_PY_CALL = re.compile(r"^[A-Za-z_]\w*\s*\(")
+_RE_WORD = re.compile(r"[A-Za-z]+")
 
 _PY_LEADS = {
     "import",
@@ -60,7 +61,7 @@ def _looks_like_prose(text: str, cmd) -> bool:
     if not remainder:
         return False
 
-    words = re.findall(r"[A-Za-z]+", remainder)
+    words = _RE_WORD.findall(remainder)
     if len(words) >= 4 and "," not in text and "=" not in text and "(" not in text:
         kwhash = getattr(cmd, "kwhash", None)
         if kwhash is not None and first in kwhash:
@@ -105,7 +106,7 @@ def should_route_to_ai(text: str, cmd) -> bool:
     if is_direct_command(stripped, cmd):
         return _looks_like_prose(stripped, cmd)
 
-    words = re.findall(r"[A-Za-z]+", stripped)
+    words = _RE_WORD.findall(stripped)
     if len(words) < 3:
         return False
 
@@ -1,11 +1,15 @@
 from __future__ import annotations
 
 from collections import deque
-import json
 import re
 from collections import Counter
 from typing import Any, Dict, Optional, Tuple
 
+from . import json_codec
+
+_RE_WHITESPACE = re.compile(r"\s+")
+_RE_PUNCT = re.compile(r"[^\w\s]")
+
 
 class DoomLoopDetector:
     def __init__(self, threshold: int = 3):
@@ -16,7 +20,7 @@ class DoomLoopDetector:
 
     def _normalize_args(self, arguments: Dict[str, Any]) -> str:
         try:
-            return json.dumps(arguments, sort_keys=True, ensure_ascii=False)
+            return json_codec.dumps(arguments, sort_keys=True)
         except Exception:
             return "{}"
 
@@ -25,8 +29,8 @@ class DoomLoopDetector:
         raw = str(text or "").strip().lower()
         if not raw:
             return ""
-        raw = re.sub(r"[\s]+", " ", raw)
-        raw = re.sub(r"[^\w\s]", "", raw)
+        raw = _RE_WHITESPACE.sub(" ", raw)
+        raw = _RE_PUNCT.sub("", raw)
         return raw.strip()
 
     @staticmethod
@@ -1,8 +1,15 @@
 from __future__ import annotations
 
+import sys
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Any, Dict, Optional
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional
+
+from . import json_codec
+
+# dataclass(slots=True) needs Python 3.10; older interpreters get plain dataclasses.
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
 
 
 class UiRole(str, Enum):
@@ -14,27 +21,102 @@ class UiRole(str, Enum):
     REASONING = "reasoning"
     ERROR = "error"
 
+    # Enum.__hash__ is Python-level and hashes the member name; hash the string
+    # value instead so set/dict lookups stay in C and agree with str equality.
+    __hash__ = str.__hash__
+
 
-@dataclass
+@dataclass(**_SLOTS)
 class UiEvent:
     role: UiRole
     text: str
     ok: Optional[bool] = None
     # Tool events may populate:
     # tool_call_id, tool_name, tool_args, tool_command, tool_result_json.
-    metadata: Dict[str, Any] = field(default_factory=dict)
+    # Read-only once constructed, so every consumer can share it without copying;
+    # use dict(event.metadata) where a mutable or JSON-serializable copy is needed.
+    metadata: Mapping[str, Any] = field(default_factory=dict)
+
+    def __post_init__(self):
+        # Wrap without copying: creators hand over a fresh dict and must not
+        # mutate it after the event is built.
+        if type(self.metadata) is not MappingProxyType:
+            self.metadata = MappingProxyType(self.metadata or {})
+
 
+def canonical_arguments_json(arguments: Dict[str, Any]) -> str:
+    return json_codec.dumps(arguments, sort_keys=True, default=str)
 
-@dataclass
+
+@dataclass(frozen=True, **_SLOTS)
 class ToolCall:
     tool_call_id: str
     name: str
     arguments: Dict[str, Any]
-    arguments_json: str = "{}"
+    # Wire text from the provider when available; canonical JSON otherwise.
+    arguments_json: str = ""
+    # Hash of (name, canonical arguments), computed once for dedupe lookups.
+    args_key: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        canonical = canonical_arguments_json(self.arguments)
+        if not self.arguments_json:
+            object.__setattr__(self, "arguments_json", canonical)
+        object.__setattr__(self, "args_key", hash((self.name, canonical)))
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class VisualValidation:
     validated: bool
     used_screenshot: bool
     warning: str = ""
+
+
+_HISTORY_FIELDS = ("role", "tool_call_id", "name", "content")
+
+
+@dataclass(eq=False, **_SLOTS)
+class HistoryEntry:
+    role: str
+    content: str
+    name: Optional[str] = None
+    tool_call_id: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "HistoryEntry":
+        name = data.get("name")
+        tool_call_id = data.get("tool_call_id")
+        return cls(
+            role=str(data.get("role") or ""),
+            content=str(data.get("content") or ""),
+            name=None if name is None else str(name),
+            tool_call_id=None if tool_call_id is None else str(tool_call_id),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Same shape as the plain history dicts persisted in chat manifests.
+        out: Dict[str, Any] = {}
+        for key in _HISTORY_FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                out[key] = value
+        return out
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, key, None) if key in _HISTORY_FIELDS else None
+        return default if value is None else value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, HistoryEntry):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
@@ -1,10 +1,10 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import os
 from typing import Callable, Dict, Iterable, List, Optional, Sequence
 
+from . import json_codec
 from .message_types import ToolCall
 from .models import DEFAULT_MODEL
 
@@ -157,7 +157,7 @@ class OpenRouterClient:
             name = str(fn.get("name") or "")
             arguments_json = str(fn.get("arguments") or "{}")
             try:
-                arguments = json.loads(arguments_json)
+                arguments = json_codec.loads(arguments_json)
                 if not isinstance(arguments, dict):
                     arguments = {"value": arguments}
             except Exception:
@@ -1,10 +1,19 @@
 from __future__ import annotations
 
+import sys
 from dataclasses import dataclass, field
 from typing import Any, Dict, List
 
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
 
-@dataclass
+
+def _clean_lines(values) -> List[str]:
+    # One str()/strip() per item; blanks (including blank lines) are dropped.
+    stripped = (str(value).strip() for value in values)
+    return [text for text in stripped if text]
+
+
+@dataclass(**_SLOTS)
 class AiPlan:
     summary: str
     commands: List[str]
@@ -19,14 +28,14 @@ class AiPlan:
         reasoning = str(data.get("reasoning", "")).strip()
 
         if isinstance(commands_raw, str):
-            commands_raw = [line for line in commands_raw.splitlines() if line.strip()]
+            commands_raw = commands_raw.splitlines()
         if not isinstance(commands_raw, list):
             raise ValueError("'commands' must be a list or string")
         if isinstance(warnings_raw, str):
             warnings_raw = [warnings_raw]
 
-        commands = [str(c).strip() for c in commands_raw if str(c).strip()]
-        warnings = [str(w).strip() for w in warnings_raw if str(w).strip()]
+        commands = _clean_lines(commands_raw)
+        warnings = _clean_lines(warnings_raw)
 
         if not summary:
             raise ValueError("missing plan summary")
@@ -36,7 +45,7 @@ class AiPlan:
         return cls(summary=summary, commands=commands, warnings=warnings, reasoning=reasoning)
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class PendingApproval:
     plan: AiPlan
     destructive: bool
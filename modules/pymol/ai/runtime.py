@@ -1,16 +1,21 @@
 from __future__ import annotations
 
-import json
+import dataclasses
+import itertools
 import logging
 import os
 import re
 import threading
 import time
 import uuid
-from typing import Dict, List, Optional, Tuple
+from collections import deque
+from enum import IntEnum
+from types import MappingProxyType
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
+from . import json_codec
 from .claude_sdk_loop import ClaudeSdkLoop
-from .message_types import UiEvent, UiRole
+from .message_types import HistoryEntry, UiEvent, UiRole
 from .openrouter_client import DEFAULT_MODEL
 from .models import is_supported_model
 from .api_key_store import load_saved_key_into_env_if_needed
@@ -62,6 +67,12 @@ SYSTEM_PROMPT_TUTOR_OVERLAY = """Mode: Tutor
 - Prefer clear, instructional explanations over terse status updates.
 """
 
+# Full system prompt per agent mode, joined once at import.
+_SYSTEM_PROMPTS = {
+    "work": SYSTEM_PROMPT_BASE + "\n" + SYSTEM_PROMPT_WORK_OVERLAY,
+    "tutor": SYSTEM_PROMPT_BASE + "\n" + SYSTEM_PROMPT_TUTOR_OVERLAY,
+}
+
 _READ_ONLY_PREFIXES = (
     "get_",
     "count_",
@@ -70,14 +81,77 @@ _READ_ONLY_PREFIXES = (
     "help",
 )
 
+_NS_PER_SEC = 1_000_000_000
 _RE_PDB_ID = re.compile(r"^[0-9][A-Za-z0-9]{3}$")
+_RE_WHITESPACE = re.compile(r"\s+")
+# Model-facing reminders; matched with one C-level startswith on a tuple.
 _HIDDEN_SYSTEM_PREFIXES = (
     "Validation required:",
     "Visual validation required now:",
+    "DOOM LOOP DETECTED:",
 )
 _CONVERSATION_MODES = ("local_first", "hybrid_resume", "resume_only")
 
 
+class ConvMode(IntEnum):
+    RESUME_ONLY = 0
+    HYBRID_RESUME = 1
+    LOCAL_FIRST = 2
+
+
+_CONV_MODE_BY_NAME = {
+    "resume_only": ConvMode.RESUME_ONLY,
+    "hybrid_resume": ConvMode.HYBRID_RESUME,
+    "local_first": ConvMode.LOCAL_FIRST,
+}
+
+_LOW_PRIORITY_ROLES = frozenset((UiRole.REASONING, UiRole.SYSTEM))
+
+_TEXT_MODE_PREFIXES = {
+    UiRole.USER: "USER>",
+    UiRole.AI: "AI>",
+    UiRole.TOOL_START: "TOOL>",
+    UiRole.TOOL_RESULT: "TOOL>",
+    UiRole.SYSTEM: "SYS>",
+    UiRole.REASONING: "RZN>",
+    UiRole.ERROR: "ERR>",
+}
+
+_PROMPT_STATE_HEADER = "Current viewer state (compact JSON):"
+_PROMPT_CONTEXT_HEADER = "Conversation context:"
+_PROMPT_REQUEST_HEADER = "User request:"
+_DISABLED_MESSAGE = "AI disabled. Use /ai on, or /cli to switch to command mode"
+
+
+def _contains_secret(obj: object, secret: str) -> bool:
+    """Walk containers and dataclasses, stopping at the first leaf containing secret."""
+    if not secret:
+        return False
+    stack = [obj]
+    seen = set()
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            if secret in item:
+                return True
+            continue
+        if isinstance(item, (dict, MappingProxyType, list, tuple, set, frozenset)) or dataclasses.is_dataclass(item):
+            if id(item) in seen:
+                continue
+            seen.add(id(item))
+            if isinstance(item, (dict, MappingProxyType)):
+                stack.extend(item.keys())
+                stack.extend(item.values())
+            elif isinstance(item, (list, tuple, set, frozenset)):
+                stack.extend(item)
+            else:
+                stack.extend(getattr(item, f.name) for f in dataclasses.fields(item))
+            continue
+        if item is not None and secret in str(item):
+            return True
+    return False
+
+
 def _env_int(name: str, default: int) -> int:
     try:
         return int(os.getenv(name, str(default)))
@@ -93,16 +167,22 @@ def _env_float(name: str, default: float) -> float:
 
 
 class AiRuntime:
-    def __init__(self, cmd):
+    def __init__(self, cmd, *, api_key: Optional[str] = None):
         self.cmd = cmd
         self._logger = logging.getLogger("pymol.ai")
         self._log_to_terminal = os.getenv("PYMOL_AI_LOG_STDOUT", "1") != "0"
         self._log_to_python_logger = os.getenv("PYMOL_AI_LOGGER", "0") == "1"
-        key_status = load_saved_key_into_env_if_needed()
-        self._api_key_source = key_status.source
+        # An explicit key takes precedence over the environment and saved keys,
+        # and is never written back into os.environ.
+        self._explicit_api_key = str(api_key or "").strip()
+        if self._explicit_api_key:
+            self._api_key_source = "argument"
+        else:
+            key_status = load_saved_key_into_env_if_needed()
+            self._api_key_source = key_status.source
         openbio_key_status = load_openbio_saved_key_into_env_if_needed()
         self._openbio_api_key_source = openbio_key_status.source
-        self.history: List[Dict[str, object]] = []
+        self.history: List[HistoryEntry] = []
         self.model = os.getenv("PYMOL_AI_DEFAULT_MODEL") or DEFAULT_MODEL
         self.reasoning_visible = _env_int("PYMOL_AI_REASONING_DEFAULT", 1) == 1
         self.agent_mode = self._normalize_agent_mode(os.getenv("PYMOL_AI_AGENT_MODE") or "work")
@@ -121,24 +201,34 @@ class AiRuntime:
             os.getenv("PYMOL_AI_CONVERSATION_MODE") or "local_first"
         )
         self.trace_stream_chunks = _env_int("PYMOL_AI_TRACE_STREAM", 0) == 1
+        self.stream_flush_interval = max(0.0, _env_float("PYMOL_AI_STREAM_FLUSH_SEC", 0.016))
 
         self.screenshot_width = _env_int("PYMOL_AI_SCREENSHOT_WIDTH", 1024)
         self.screenshot_height = _env_int("PYMOL_AI_SCREENSHOT_HEIGHT", 0)
         self.screenshot_validate_required = _env_int("PYMOL_AI_SCREENSHOT_VALIDATE_REQUIRED", 1) == 1
+        # Opt-in: only read-only commands are ever skipped, see execute_run_command_tool.
+        self.skip_duplicate_commands = _env_int("PYMOL_AI_SKIP_DUPLICATE_COMMANDS", 0) == 1
         self.state_max_selections = _env_int("PYMOL_AI_STATE_MAX_SELECTIONS", 20)
         self.state_max_objects = _env_int("PYMOL_AI_STATE_MAX_OBJECTS", 30)
+        self.recent_tool_results_cap = max(1, _env_int("PYMOL_AI_RECENT_TOOL_RESULTS", 20))
 
         self._busy = False
         self._lock = threading.Lock()
         self._event_lock = threading.Lock()
-        self._ui_events: List[UiEvent] = []
+        # Low-priority roles are dropped first on overflow; seq restores FIFO order on drain.
+        self._ui_low: Deque[Tuple[int, UiEvent]] = deque()
+        self._ui_high: Deque[Tuple[int, UiEvent]] = deque()
+        self._ui_seq = itertools.count()
         self._ui_mode = "text"
         self._cancel_event = threading.Event()
         self._ui_compaction_notice_sent = False
 
-        self._stream_line_buffer = ""
+        # Streamed pieces are collected in lists and joined on flush / at turn end,
+        # so long responses stay linear instead of re-copying a growing string.
+        self._stream_line_parts: List[str] = []
+        self._stream_last_flush = 0.0
         self._stream_had_output = False
-        self._stream_full_text = ""
+        self._stream_text_parts: List[str] = []
 
         disabled = os.getenv("PYMOL_AI_DISABLE", "").strip() == "1"
         self.enabled = bool(self._api_key) and not disabled
@@ -146,10 +236,17 @@ class AiRuntime:
         self._agent_backend = "claude_sdk"
         self._sdk_session_id: Optional[str] = None
         self._chat_query_session_id = self._new_chat_query_session_id()
-        self._sdk_loop = ClaudeSdkLoop(logger=self._log_ai)
+        self._sdk_loop = ClaudeSdkLoop(logger=self._log_ai, auth_token=self._explicit_api_key or None)
         self._sdk_loop.set_trace_stream(self.trace_stream_chunks)
         self._sdk_loop.map_openrouter_env()
-        self._recent_tool_results: List[Dict[str, object]] = []
+        self._recent_tool_results: Deque[Dict[str, object]] = deque(maxlen=self.recent_tool_results_cap)
+        # Viewer state summary reused until a command runs or a new turn starts
+        # (the user may change the scene between turns without going through us).
+        self._state_rev = 0
+        self._state_snapshot_cache: Optional[Tuple[int, Dict[str, object]]] = None
+        # (tool_name, normalized command) of read-only commands that succeeded since
+        # the last state-changing command in the current agent turn.
+        self._turn_tool_keys: Set[Tuple[str, str]] = set()
         self._log_ai(
             "runtime initialized",
             enabled=self.enabled,
@@ -169,12 +266,35 @@ class AiRuntime:
 
     @property
     def _api_key(self) -> str:
+        if self._explicit_api_key:
+            return self._explicit_api_key
         return (os.getenv("OPENROUTER_API_KEY") or os.getenv("ANTHROPIC_AUTH_TOKEN") or "").strip()
 
     @property
     def _openbio_api_key(self) -> str:
         return (os.getenv("OPENBIO_API_KEY") or "").strip()
 
+    @property
+    def long_tool_warn_sec(self) -> float:
+        return self._long_tool_warn_sec
+
+    @long_tool_warn_sec.setter
+    def long_tool_warn_sec(self, seconds: float) -> None:
+        # Tool timing is compared in integer nanoseconds; negative disables the warning.
+        self._long_tool_warn_sec = float(seconds)
+        self._long_tool_warn_ns = -1 if seconds < 0 else int(seconds * _NS_PER_SEC)
+
+    @property
+    def conversation_mode(self) -> str:
+        return self._conversation_mode
+
+    @conversation_mode.setter
+    def conversation_mode(self, mode: str) -> None:
+        # Resolve the enum once here so each turn branches on identity, not strings.
+        normalized = self._normalize_conversation_mode(mode)
+        self._conversation_mode = normalized
+        self._conv_mode = _CONV_MODE_BY_NAME[normalized]
+
     @staticmethod
     def _normalize_agent_mode(mode: str) -> str:
         return "tutor" if str(mode or "").strip().lower() == "tutor" else "work"
@@ -274,9 +394,11 @@ class AiRuntime:
 
     def clear_session(self, emit_notice: bool = True) -> None:
         self.history.clear()
-        self._stream_line_buffer = ""
-        self._stream_full_text = ""
+        with self._event_lock:
+            self._stream_line_parts.clear()
+            self._stream_text_parts.clear()
         self._recent_tool_results.clear()
+        self._invalidate_state_summary()
         self.reset_remote_session_binding(reason="clear_session")
         self._log_ai("session cleared", emit_notice=emit_notice)
         if emit_notice:
@@ -314,7 +436,7 @@ class AiRuntime:
     def export_session_state(self) -> Dict[str, object]:
         return {
             "input_mode": "cli" if self.input_mode == "cli" else "ai",
-            "history": list(self.history[-self.history_max_messages :]),
+            "history": [self._history_entry_dict(m) for m in self.history[-self.history_max_messages :]],
             "backend": self._agent_backend,
             "sdk_session_id": self._sdk_session_id,
             "conversation_mode": self.conversation_mode,
@@ -331,8 +453,9 @@ class AiRuntime:
 
     def import_session_state(self, state: Optional[Dict[str, object]], apply_model: bool = False) -> None:
         payload = dict(state or {})
-        self._stream_line_buffer = ""
-        self._stream_full_text = ""
+        with self._event_lock:
+            self._stream_line_parts.clear()
+            self._stream_text_parts.clear()
 
         mode = "cli" if str(payload.get("input_mode") or "").lower() == "cli" else "ai"
         self.input_mode = mode
@@ -345,7 +468,11 @@ class AiRuntime:
 
         history = payload.get("history") or []
         if isinstance(history, list):
-            self.history = list(history[-self.history_max_messages :])
+            self.history = [
+                m if isinstance(m, HistoryEntry) else HistoryEntry.from_dict(m)
+                for m in history[-self.history_max_messages :]
+                if isinstance(m, (HistoryEntry, dict))
+            ]
         else:
             self.history = []
 
@@ -379,74 +506,133 @@ class AiRuntime:
         )
 
     def emit_ui_event(self, event: UiEvent) -> None:
-        if event.role == UiRole.SYSTEM and self._is_internal_system_reminder(event.text):
-            return
+        self.emit_ui_events((event,))
+
+    def emit_ui_events(self, events: Iterable[UiEvent]) -> None:
+        # Internal reminders are never shown; reject them before touching the queue.
+        visible = [
+            event
+            for event in events
+            if not (event.role is UiRole.SYSTEM and event.text.startswith(_HIDDEN_SYSTEM_PREFIXES))
+        ]
+        if visible:
+            self._enqueue_ui_events(visible)
 
+    def _enqueue_ui_events(self, visible: List[UiEvent]) -> None:
+        # One lock round-trip and one compaction pass for the whole batch.
         with self._event_lock:
-            self._ui_events.append(event)
+            # Coalesced stream text goes first so it stays ahead of whatever follows it.
+            pending = self._take_stream_text_locked()
+            if pending is not None:
+                visible.insert(0, pending)
+            if not visible:
+                return
+            seq = self._ui_seq
+            for event in visible:
+                bucket = self._ui_low if event.role in _LOW_PRIORITY_ROLES else self._ui_high
+                bucket.append((next(seq), event))
             self._compact_ui_events_locked()
 
         if self._ui_mode != "qt":
-            prefix = {
-                UiRole.USER: "USER>",
-                UiRole.AI: "AI>",
-                UiRole.TOOL_START: "TOOL>",
-                UiRole.TOOL_RESULT: "TOOL>",
-                UiRole.SYSTEM: "SYS>",
-                UiRole.REASONING: "RZN>",
-                UiRole.ERROR: "ERR>",
-            }.get(event.role, "AI>")
-            print("%s %s" % (prefix, event.text))
+            for event in visible:
+                print("%s %s" % (_TEXT_MODE_PREFIXES.get(event.role, "AI>"), event.text))
+
+    def _take_stream_text_locked(self) -> Optional[UiEvent]:
+        if not self._stream_line_parts:
+            return None
+        text = "".join(self._stream_line_parts)
+        self._stream_line_parts.clear()
+        self._stream_last_flush = time.monotonic()
+        return UiEvent(role=UiRole.AI, text=text, metadata={"stream_chunk": True})
 
     @staticmethod
     def _is_internal_system_reminder(text: str) -> bool:
-        msg = str(text or "")
-        return any(msg.startswith(prefix) for prefix in _HIDDEN_SYSTEM_PREFIXES)
+        return str(text or "").startswith(_HIDDEN_SYSTEM_PREFIXES)
+
+    def _ui_event_count_locked(self) -> int:
+        return len(self._ui_low) + len(self._ui_high)
+
+    def _drop_ui_event_locked(self) -> None:
+        if self._ui_low:
+            self._ui_low.popleft()
+        elif self._ui_high:
+            self._ui_high.popleft()
 
     def _compact_ui_events_locked(self) -> None:
         if self.ui_max_events <= 0:
             return
-        if len(self._ui_events) <= self.ui_max_events:
+        if self._ui_event_count_locked() <= self.ui_max_events:
             return
 
-        def drop_index():
-            for i, evt in enumerate(self._ui_events):
-                if evt.role in (UiRole.REASONING, UiRole.SYSTEM):
-                    if "compacted to keep UI responsive" in str(evt.text or ""):
-                        continue
-                    return i
-            return 0
-
-        while len(self._ui_events) > self.ui_max_events:
-            self._ui_events.pop(drop_index())
+        while self._ui_event_count_locked() > self.ui_max_events:
+            self._drop_ui_event_locked()
 
         if not self._ui_compaction_notice_sent:
-            if len(self._ui_events) >= self.ui_max_events:
-                self._ui_events.pop(drop_index())
-            self._ui_events.append(
-                UiEvent(
-                    role=UiRole.SYSTEM,
-                    text="chat output compacted to keep UI responsive",
+            if self._ui_event_count_locked() >= self.ui_max_events:
+                self._drop_ui_event_locked()
+            # Queued as high priority so later compaction never drops the notice first.
+            self._ui_high.append(
+                (
+                    next(self._ui_seq),
+                    UiEvent(
+                        role=UiRole.SYSTEM,
+                        text="chat output compacted to keep UI responsive",
+                    ),
                 )
             )
             self._ui_compaction_notice_sent = True
 
+    def _pop_oldest_ui_event_locked(self) -> UiEvent:
+        low, high = self._ui_low, self._ui_high
+        if low and (not high or low[0][0] < high[0][0]):
+            return low.popleft()[1]
+        return high.popleft()[1]
+
     def has_pending_ui_events(self) -> bool:
+        # deque/list truthiness is atomic under the GIL; no lock needed for a peek.
+        # Coalesced stream text counts too: drain_ui_events turns it into an event.
+        return bool(self._ui_high) or bool(self._ui_low) or bool(self._stream_line_parts)
+
+    def _flush_stream_text(self) -> None:
+        # Coalesced stream text is queued (and printed in text mode) through the
+        # normal enqueue path before a drain takes its count.
+        if self._stream_line_parts:
+            self._enqueue_ui_events([])
+
+    def _drain_count_locked(self, limit: Optional[int]) -> int:
+        n = self._ui_event_count_locked()
+        if limit is not None:
+            n = min(max(0, int(limit)), n)
+        return n
+
+    def _mark_drained_locked(self) -> None:
+        if not self._ui_low and not self._ui_high:
+            self._ui_compaction_notice_sent = False
+
+    def drain_ui_events(self, limit: Optional[int] = None) -> Tuple[UiEvent, ...]:
+        self._flush_stream_text()
         with self._event_lock:
-            return bool(self._ui_events)
+            n = self._drain_count_locked(limit)
+            out = tuple(self._pop_oldest_ui_event_locked() for _ in range(n))
+            self._mark_drained_locked()
+        return out
 
-    def drain_ui_events(self, limit: Optional[int] = None) -> List[UiEvent]:
+    def iter_drain_ui_events(self, limit: Optional[int] = None) -> Iterator[UiEvent]:
+        # Lazy variant of drain_ui_events: pops one event per step, so nothing is
+        # materialized and unconsumed events stay queued if the caller stops early.
+        # Only events queued when iteration starts are yielded.
+        self._flush_stream_text()
         with self._event_lock:
-            if limit is None:
-                out = list(self._ui_events)
-                self._ui_events.clear()
-            else:
-                n = max(0, int(limit))
-                out = list(self._ui_events[:n])
-                del self._ui_events[:n]
-            if not self._ui_events:
-                self._ui_compaction_notice_sent = False
-        return out
+            n = self._drain_count_locked(limit)
+        for _ in range(n):
+            with self._event_lock:
+                if not self._ui_low and not self._ui_high:
+                    # Compaction dropped events since the count was taken.
+                    self._mark_drained_locked()
+                    return
+                event = self._pop_oldest_ui_event_locked()
+                self._mark_drained_locked()
+            yield event
 
     def handle_typed_input(self, text: str) -> bool:
         raw = text.rstrip("\n")
@@ -478,12 +664,7 @@ class AiRuntime:
 
         if not self.enabled:
             self._log_ai("ai request rejected: disabled", level="WARNING", text=raw)
-            self.emit_ui_event(
-                UiEvent(
-                    role=UiRole.ERROR,
-                    text="AI disabled. Use /ai on, or /cli to switch to command mode",
-                )
-            )
+            self.emit_ui_event(UiEvent(role=UiRole.ERROR, text=_DISABLED_MESSAGE))
             return True
 
         self._start_agent_request(raw)
@@ -605,12 +786,23 @@ class AiRuntime:
         )
         thread.start()
 
-    def _append_history(self, message: Dict[str, object]) -> None:
-        self.history.append(message)
-        if len(self.history) > self.history_max_messages:
-            self.history = self.history[-self.history_max_messages :]
+    def _append_history(self, entry: HistoryEntry) -> None:
+        self._extend_history((entry,))
+
+    def _extend_history(self, entries: Iterable[HistoryEntry]) -> None:
+        self.history.extend(entries)
+        # Let the list run to twice the cap and then drop the excess in one slice,
+        # so appends stay amortized O(1). Readers only look at the last N entries.
+        if len(self.history) > 2 * self.history_max_messages:
+            del self.history[: -self.history_max_messages]
 
-    def _format_history_entry(self, message: Dict[str, object]) -> str:
+    @staticmethod
+    def _history_entry_dict(message) -> Dict[str, object]:
+        if isinstance(message, HistoryEntry):
+            return message.to_dict()
+        return dict(message)
+
+    def _format_history_entry(self, message) -> str:
         role = str(message.get("role") or "").strip()
         if role in ("user", "assistant", "system"):
             content = str(message.get("content") or "").strip()
@@ -658,14 +850,17 @@ class AiRuntime:
             selected_rev.append(line)
             used += line_len
 
-        selected = list(reversed(selected_rev))
-        omitted = len(entries) - len(selected)
+        omitted = len(entries) - len(selected_rev)
         if omitted > 0:
-            selected.insert(0, "[%d older context entries omitted]" % (omitted,))
-        return selected
+            selected_rev.append("[%d older context entries omitted]" % (omitted,))
+        selected_rev.reverse()
+        return selected_rev
 
     def _state_summary_for_prompt(self) -> Dict[str, object]:
-        return self._run_in_gui(
+        cached = self._state_snapshot_cache
+        if cached is not None and cached[0] == self._state_rev:
+            return cached[1]
+        summary = self._run_in_gui(
             lambda: build_viewer_state_snapshot(
                 self.cmd,
                 max_objects=self.state_max_objects,
@@ -673,29 +868,30 @@ class AiRuntime:
                 recent_tool_results=self._recent_tool_results,
             )
         )
+        self._state_snapshot_cache = (self._state_rev, summary)
+        return summary
+
+    def _invalidate_state_summary(self) -> None:
+        self._state_rev += 1
 
     def _build_system_prompt(self) -> str:
-        mode = self._normalize_agent_mode(self.agent_mode)
-        overlay = SYSTEM_PROMPT_TUTOR_OVERLAY if mode == "tutor" else SYSTEM_PROMPT_WORK_OVERLAY
-        return SYSTEM_PROMPT_BASE + "\n" + overlay
+        return _SYSTEM_PROMPTS[self._normalize_agent_mode(self.agent_mode)]
 
     def _build_turn_prompt(self, prompt: str, *, include_history_context: bool) -> str:
         state_summary = self._state_summary_for_prompt()
         lines = [
-            "Current viewer state (compact JSON):",
-            json.dumps(state_summary, ensure_ascii=False),
+            _PROMPT_STATE_HEADER,
+            json_codec.dumps(state_summary),
         ]
 
+        # resume_only never carries local context, so the history walk is skipped.
         if include_history_context:
             context_lines = self._history_context_lines()
             if context_lines:
-                lines.append("")
-                lines.append("Conversation context:")
-                lines.extend(context_lines)
+                lines += ("", _PROMPT_CONTEXT_HEADER)
+                lines += context_lines
 
-        lines.append("")
-        lines.append("User request:")
-        lines.append(str(prompt or ""))
+        lines += ("", _PROMPT_REQUEST_HEADER, str(prompt or ""))
         return "\n".join(lines)
 
     def _on_assistant_chunk(self, chunk: str) -> None:
@@ -705,7 +901,7 @@ class AiRuntime:
         if not piece:
             return
         self._stream_had_output = True
-        self._stream_full_text += piece
+        self._stream_text_parts.append(piece)
         if self.trace_stream_chunks:
             self._log_ai(
                 "stream chunk",
@@ -713,7 +909,14 @@ class AiRuntime:
                 chars=len(piece),
                 preview=piece[:120],
             )
-        self.emit_ui_event(UiEvent(role=UiRole.AI, text=piece, metadata={"stream_chunk": True}))
+        # Providers call back many times per second; batch pieces into one UI event
+        # per line or per flush interval. drain_ui_events picks up any remainder.
+        now = time.monotonic()
+        with self._event_lock:
+            self._stream_line_parts.append(piece)
+            if "\n" not in piece and now - self._stream_last_flush < self.stream_flush_interval:
+                return
+        self._enqueue_ui_events([])
 
     def _on_assistant_message_boundary(self) -> None:
         if self._cancel_event.is_set():
@@ -723,9 +926,7 @@ class AiRuntime:
         self.emit_ui_event(UiEvent(role=UiRole.AI, text="", metadata={"stream_boundary": True}))
 
     def _flush_assistant_chunks(self) -> None:
-        if self._stream_line_buffer.strip():
-            self.emit_ui_event(UiEvent(role=UiRole.AI, text=self._stream_line_buffer.strip()))
-        self._stream_line_buffer = ""
+        self._enqueue_ui_events([])
 
     def _canonicalize_command(self, command: str):
         stripped = str(command or "").strip()
@@ -746,6 +947,8 @@ class AiRuntime:
         return True
 
     def _remember_tool_result(self, command: str, ok: bool, error: str) -> None:
+        # Every executed command (even a failed one) may have changed the scene.
+        self._invalidate_state_summary()
         self._recent_tool_results.append(
             {
                 "command": command,
@@ -753,8 +956,6 @@ class AiRuntime:
                 "error": error[:240] if error else "",
             }
         )
-        if len(self._recent_tool_results) > 20:
-            self._recent_tool_results = self._recent_tool_results[-20:]
 
     def _execute_cli_command(self, command: str) -> None:
         fixed, note = self._canonicalize_command(command)
@@ -762,7 +963,7 @@ class AiRuntime:
             self.emit_ui_event(UiEvent(role=UiRole.SYSTEM, text=note))
 
         self._log_ai("executing cli command", command=fixed)
-        self._append_history({"role": "user", "content": "CLI command: %s" % (fixed,)})
+        self._append_history(HistoryEntry(role="user", content="CLI command: %s" % (fixed,)))
         result = self._run_in_gui(lambda c=fixed: run_pymol_command(self.cmd, c))
         self._log_ai(
             "cli command finished",
@@ -794,7 +995,7 @@ class AiRuntime:
         )
 
     def _tool_result_content(self, payload: Dict[str, object]) -> str:
-        return json.dumps(payload, ensure_ascii=False)
+        return json_codec.dumps(payload)
 
     def _tool_result_metadata_payload(self, payload: Dict[str, object]) -> object:
         serialized = self._tool_result_content(payload)
@@ -807,7 +1008,7 @@ class AiRuntime:
 
     @staticmethod
     def _normalized_command_key(command: str) -> str:
-        return re.sub(r"\s+", " ", str(command or "").strip().lower())
+        return _RE_WHITESPACE.sub(" ", str(command or "").strip().lower())
 
     @staticmethod
     def _normalize_sdk_tool_name(raw_name: str) -> Tuple[str, str]:
@@ -824,14 +1025,15 @@ class AiRuntime:
         return name, name
 
     def _execute_snapshot_tool(self) -> Tuple[Dict[str, object], Optional[str], Dict[str, object]]:
-        capture = self._run_in_gui(
-            lambda: capture_viewer_snapshot(
-                self.cmd,
-                width=self.screenshot_width,
-                height=self.screenshot_height,
-            )
+        # Runs on the agent thread: only the render goes through _run_in_gui, the
+        # temp-file read and base64 encode stay here. GUI calls are made one at a
+        # time because MainThreadCaller supports a single waiting caller.
+        capture = capture_viewer_snapshot(
+            self.cmd,
+            width=self.screenshot_width,
+            height=self.screenshot_height,
+            call_in_gui=self._run_in_gui,
         )
-
         state_summary = self._state_summary_for_prompt()
         image_data_url = capture.get("image_data_url") if capture.get("ok") else None
 
@@ -865,24 +1067,27 @@ class AiRuntime:
             if check_cancel():
                 return
 
-            self._append_history({"role": "user", "content": prompt})
+            self._append_history(HistoryEntry(role="user", content=prompt))
+            self._turn_tool_keys.clear()
+            self._invalidate_state_summary()
             self._stream_had_output = False
-            self._stream_line_buffer = ""
-            self._stream_full_text = ""
+            with self._event_lock:
+                self._stream_line_parts.clear()
+                self._stream_text_parts.clear()
 
             pending_validation_required = False
             validation_done_this_turn = False
             slow_tool_notice_emitted = False
             snapshot_state_summary: Optional[Dict[str, object]] = None
 
-            def maybe_emit_slow_tool_warning(elapsed: float) -> None:
+            def maybe_emit_slow_tool_warning(elapsed_ns: int) -> None:
                 nonlocal slow_tool_notice_emitted
-                if self.long_tool_warn_sec < 0:
-                    return
-                if elapsed < self.long_tool_warn_sec:
-                    return
                 if slow_tool_notice_emitted:
                     return
+                warn_ns = self._long_tool_warn_ns
+                if warn_ns < 0 or elapsed_ns < warn_ns:
+                    return
+                elapsed = elapsed_ns / _NS_PER_SEC
                 self.emit_ui_event(
                     UiEvent(
                         role=UiRole.SYSTEM,
@@ -895,28 +1100,86 @@ class AiRuntime:
                 self._log_ai("slow tool warning emitted", elapsed="%.3f" % (elapsed,))
                 slow_tool_notice_emitted = True
 
+            def skip_duplicate_run_command(
+                tool_call_id: str,
+                tool_args: Dict[str, object],
+                command: str,
+            ) -> Dict[str, object]:
+                self._log_ai("tool run skipped: duplicate in turn", tool_call_id=tool_call_id, command=command)
+                payload = {
+                    "ok": True,
+                    "command": command,
+                    "error": None,
+                    "feedback_lines": [],
+                    "skipped": True,
+                    "note": "identical command already succeeded earlier in this request; not re-run",
+                }
+                self.emit_ui_event(
+                    UiEvent(
+                        role=UiRole.TOOL_RESULT,
+                        text="Skipped duplicate: %s" % (command,),
+                        ok=True,
+                        metadata={
+                            "tool_call_id": tool_call_id,
+                            "tool_name": "run_pymol_command",
+                            "tool_args": dict(tool_args or {}),
+                            "tool_command": command,
+                            "tool_result_json": payload,
+                        },
+                    )
+                )
+                self._append_history(
+                    HistoryEntry(
+                        role="tool",
+                        tool_call_id=tool_call_id,
+                        name="run_pymol_command",
+                        content=self._tool_result_content(payload),
+                    )
+                )
+                return payload
+
+            def cancelled_tool_payload(tool_call_id: str, tool_name: str) -> Dict[str, object]:
+                # The SDK may still dispatch queued tool calls after an interrupt; never run them.
+                self._log_ai("tool skipped after cancel", tool_call_id=tool_call_id, tool_name=tool_name)
+                return {"ok": False, "error": "request cancelled", "cancelled": True}
+
             def execute_run_command_tool(tool_call_id: str, tool_args: Dict[str, object]) -> Dict[str, object]:
                 nonlocal pending_validation_required
+                if is_cancelled():
+                    return cancelled_tool_payload(tool_call_id, "run_pymol_command")
                 command = str(tool_args.get("command") or "").strip()
                 command, note = self._canonicalize_command(command)
                 if note:
                     self.emit_ui_event(UiEvent(role=UiRole.SYSTEM, text=note))
 
+                # Only read-only commands are deduplicated; anything else always runs
+                # and clears the per-turn record, since the scene may have changed.
+                state_changing = self._is_state_changing_command(command)
+                run_key = None
+                if self.skip_duplicate_commands and not state_changing:
+                    run_key = ("run_pymol_command", self._normalized_command_key(command))
+                    if run_key in self._turn_tool_keys:
+                        return skip_duplicate_run_command(tool_call_id, tool_args, command)
+
                 self._log_ai("tool run start", tool_call_id=tool_call_id, command=command)
-                started = time.monotonic()
+                started = time.monotonic_ns()
                 exec_result = self._run_in_gui(lambda c=command: run_pymol_command(self.cmd, c))
-                elapsed = time.monotonic() - started
-                maybe_emit_slow_tool_warning(elapsed)
+                elapsed_ns = time.monotonic_ns() - started
+                maybe_emit_slow_tool_warning(elapsed_ns)
                 self._log_ai(
                     "tool run done",
                     tool_call_id=tool_call_id,
                     command=exec_result.command,
                     ok=exec_result.ok,
-                    elapsed="%.3f" % (elapsed,),
+                    elapsed="%.3f" % (elapsed_ns / _NS_PER_SEC,),
                     error=exec_result.error or "",
                 )
 
                 self._remember_tool_result(exec_result.command, exec_result.ok, exec_result.error)
+                if state_changing:
+                    self._turn_tool_keys.clear()
+                elif run_key is not None and exec_result.ok:
+                    self._turn_tool_keys.add(run_key)
                 payload = {
                     "ok": exec_result.ok,
                     "command": exec_result.command,
@@ -943,12 +1206,12 @@ class AiRuntime:
                 if len(msg_content) > self.tool_result_max_chars:
                     msg_content = msg_content[: self.tool_result_max_chars] + "... [truncated]"
                 self._append_history(
-                    {
-                        "role": "tool",
-                        "tool_call_id": tool_call_id,
-                        "name": "run_pymol_command",
-                        "content": msg_content,
-                    }
+                    HistoryEntry(
+                        role="tool",
+                        tool_call_id=tool_call_id,
+                        name="run_pymol_command",
+                        content=msg_content,
+                    )
                 )
 
                 if self._is_state_changing_command(str(payload.get("command") or command)):
@@ -958,16 +1221,21 @@ class AiRuntime:
 
             def execute_snapshot_tool(tool_call_id: str, tool_args: Dict[str, object]) -> Dict[str, object]:
                 nonlocal pending_validation_required, validation_done_this_turn, snapshot_state_summary
+                if is_cancelled():
+                    return {
+                        "payload": cancelled_tool_payload(tool_call_id, "capture_viewer_snapshot"),
+                        "image_data_url": None,
+                    }
                 self._log_ai("snapshot tool start", tool_call_id=tool_call_id, args=tool_args)
-                started = time.monotonic()
+                started = time.monotonic_ns()
                 payload, image_data_url, state_summary = self._execute_snapshot_tool()
-                elapsed = time.monotonic() - started
-                maybe_emit_slow_tool_warning(elapsed)
+                elapsed_ns = time.monotonic_ns() - started
+                maybe_emit_slow_tool_warning(elapsed_ns)
                 self._log_ai(
                     "snapshot tool done",
                     tool_call_id=tool_call_id,
                     ok=bool(payload.get("ok")),
-                    elapsed="%.3f" % (elapsed,),
+                    elapsed="%.3f" % (elapsed_ns / _NS_PER_SEC,),
                     error=payload.get("error") or "",
                 )
 
@@ -994,12 +1262,12 @@ class AiRuntime:
                 )
 
                 self._append_history(
-                    {
-                        "role": "tool",
-                        "tool_call_id": tool_call_id,
-                        "name": "capture_viewer_snapshot",
-                        "content": self._tool_result_content(payload),
-                    }
+                    HistoryEntry(
+                        role="tool",
+                        tool_call_id=tool_call_id,
+                        name="capture_viewer_snapshot",
+                        content=self._tool_result_content(payload),
+                    )
                 )
 
                 validation_done_this_turn = True
@@ -1016,26 +1284,28 @@ class AiRuntime:
             ) -> Dict[str, object]:
                 payload_args = dict(tool_args or {})
                 resolved_name = str(tool_name or "").strip()
+                if is_cancelled():
+                    return cancelled_tool_payload(tool_call_id, resolved_name)
                 self._log_ai(
                     "openbio tool start",
                     tool_call_id=tool_call_id,
                     tool_name=resolved_name,
                     args=payload_args,
                 )
-                started = time.monotonic()
+                started = time.monotonic_ns()
                 payload = execute_openbio_api_gateway_tool(
                     resolved_name,
                     payload_args,
                     working_dir=os.path.realpath(os.getcwd()),
                 )
-                elapsed = time.monotonic() - started
-                maybe_emit_slow_tool_warning(elapsed)
+                elapsed_ns = time.monotonic_ns() - started
+                maybe_emit_slow_tool_warning(elapsed_ns)
                 self._log_ai(
                     "openbio tool done",
                     tool_call_id=tool_call_id,
                     tool_name=resolved_name,
                     ok=bool(payload.get("ok")),
-                    elapsed="%.3f" % (elapsed,),
+                    elapsed="%.3f" % (elapsed_ns / _NS_PER_SEC,),
                     error=payload.get("error") or "",
                 )
 
@@ -1059,12 +1329,12 @@ class AiRuntime:
                 if len(content) > self.tool_result_max_chars:
                     content = content[: self.tool_result_max_chars] + "... [truncated]"
                 self._append_history(
-                    {
-                        "role": "tool",
-                        "tool_call_id": tool_call_id,
-                        "name": resolved_name or "openbio_api_tool",
-                        "content": content,
-                    }
+                    HistoryEntry(
+                        role="tool",
+                        tool_call_id=tool_call_id,
+                        name=resolved_name or "openbio_api_tool",
+                        content=content,
+                    )
                 )
                 return payload
 
@@ -1132,12 +1402,12 @@ class AiRuntime:
                 if len(content) > self.tool_result_max_chars:
                     content = content[: self.tool_result_max_chars] + "... [truncated]"
                 self._append_history(
-                    {
-                        "role": "tool",
-                        "tool_call_id": tool_call_id or "external_tool",
-                        "name": display_name or normalized or "tool",
-                        "content": content,
-                    }
+                    HistoryEntry(
+                        role="tool",
+                        tool_call_id=tool_call_id or "external_tool",
+                        name=display_name or normalized or "tool",
+                        content=content,
+                    )
                 )
 
             def run_sdk_turn(
@@ -1173,14 +1443,13 @@ class AiRuntime:
                     session_reset_reason=session_reset_reason,
                 )
 
-            include_history_context = self.conversation_mode == "local_first"
+            conv_mode = self._conv_mode
+            include_history_context = conv_mode is ConvMode.LOCAL_FIRST
             resume_session_id: Optional[str] = None
-            if self.conversation_mode in ("hybrid_resume", "resume_only"):
+            if conv_mode is not ConvMode.LOCAL_FIRST:
                 resume_session_id = self._sdk_session_id
-            if self.conversation_mode == "hybrid_resume" and not resume_session_id:
+            if conv_mode is ConvMode.HYBRID_RESUME and not resume_session_id:
                 include_history_context = True
-            if self.conversation_mode == "resume_only":
-                include_history_context = False
 
             turn_prompt = self._build_turn_prompt(prompt, include_history_context=include_history_context)
             self._log_ai(
@@ -1244,15 +1513,15 @@ class AiRuntime:
                 execute_snapshot_tool("auto_capture_viewer_snapshot_1", {"purpose": "auto_validation"})
 
             assistant_text = str(result.assistant_text or "").strip()
+            streamed_text = "".join(self._stream_text_parts).strip() if self._stream_had_output else ""
             if assistant_text:
                 self._log_ai("assistant final text emitted", chars=len(assistant_text))
                 if not self._stream_had_output:
                     self.emit_ui_event(UiEvent(role=UiRole.AI, text=assistant_text))
-                self._append_history({"role": "assistant", "content": assistant_text})
-            elif self._stream_had_output and self._stream_full_text.strip():
-                streamed_text = self._stream_full_text.strip()
+                self._append_history(HistoryEntry(role="assistant", content=assistant_text))
+            elif streamed_text:
                 self._log_ai("assistant final text inferred from streamed chunks", chars=len(streamed_text))
-                self._append_history({"role": "assistant", "content": streamed_text})
+                self._append_history(HistoryEntry(role="assistant", content=streamed_text))
             elif self.final_answer_enabled:
                 turns_used = result.num_turns if isinstance(result.num_turns, int) else None
                 max_turns_hit = turns_used is not None and turns_used >= self.max_agent_steps
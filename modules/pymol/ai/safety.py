@@ -15,7 +15,12 @@ _DESTRUCTIVE_PREFIXES = (
     "reset",
 )
 
-_RE_BROAD_EDIT = re.compile(r"^alter\b.*\b(all|\*)\b", re.IGNORECASE)
+# One anchored pass: a destructive keyword alone or followed by a space, or an
+# alter over all atoms.
+_RE_DESTRUCTIVE = re.compile(
+    r"^(?:(?:%s)(?: |$)|alter\b.*\b(all|\*)\b)" % "|".join(_DESTRUCTIVE_PREFIXES),
+    re.IGNORECASE,
+)
 _RE_BLOCKED_PREFIX = re.compile(r"^(/|!|python\s+|_($|\s+))", re.IGNORECASE)
 
 
@@ -29,18 +34,7 @@ class SafetyResult:
 
 
 def is_destructive_command(command: str) -> bool:
-    text = command.strip().lower()
-    if not text:
-        return False
-
-    for prefix in _DESTRUCTIVE_PREFIXES:
-        if text == prefix or text.startswith(prefix + " "):
-            return True
-
-    if _RE_BROAD_EDIT.search(text):
-        return True
-
-    return False
+    return _RE_DESTRUCTIVE.match(command.strip()) is not None
 
 
 def is_blocked_command(command: str) -> bool:
@@ -56,18 +50,19 @@ def classify_plan(commands: Iterable[str]) -> SafetyResult:
 
 
 def validate_plan(plan: AiPlan) -> SafetyResult:
-    for command in plan.commands:
-        if is_blocked_command(command):
-            raise PlanValidationError(
-                "plan contains blocked command syntax: %r" % (command,)
-            )
-
+    # Size gate first so an oversized plan is rejected without scanning it.
     count = len(plan.commands)
     if count > MAX_COMMANDS:
         raise PlanValidationError(
             "plan has %d commands, limit is %d" % (count, MAX_COMMANDS)
         )
 
+    for command in plan.commands:
+        if is_blocked_command(command):
+            raise PlanValidationError(
+                "plan contains blocked command syntax: %r" % (command,)
+            )
+
     result = classify_plan(plan.commands)
     if result.destructive:
         warning = "Destructive commands detected. Extra confirmation required."
@@ -45,25 +45,25 @@ def build_viewer_state_snapshot(
     enabled_objects = _as_list(cmd.get_names("objects", enabled_only=1))
     selections = _as_list(cmd.get_names("public_selections", enabled_only=1))
 
-    selection_counts: Dict[str, int] = {}
-    for name in selections[:max_selections]:
-        try:
-            selection_counts[name] = int(cmd.count_atoms(name))
-        except Exception:
-            selection_counts[name] = -1
+    # Counts and atom details in one pass over the capped selection list; the
+    # limits are normalized once instead of per selection.
+    detail_limit = max(0, int(max_detailed_selections))
+    detail_max_count = max(1, int(max_selection_atom_count_for_details))
+    atom_limit = max(1, int(max_selection_atoms))
 
+    selection_counts: Dict[str, int] = {}
     selection_atom_ids: Dict[str, List[str]] = {}
     selection_atom_ids_truncated: Dict[str, bool] = {}
     detailed = 0
     for name in selections[:max_selections]:
-        if detailed >= max(0, int(max_detailed_selections)):
-            break
-        count = int(selection_counts.get(name, -1))
-        if count <= 0:
-            continue
-        if count > max(1, int(max_selection_atom_count_for_details)):
+        try:
+            count = int(cmd.count_atoms(name))
+        except Exception:
+            count = -1
+        selection_counts[name] = count
+        if detailed >= detail_limit or count <= 0 or count > detail_max_count:
             continue
-        ids = _selection_atom_ids(cmd, name, max(1, int(max_selection_atoms)))
+        ids = _selection_atom_ids(cmd, name, atom_limit)
         if not ids:
             continue
         selection_atom_ids[name] = ids
@@ -3,7 +3,7 @@ from __future__ import annotations
 import base64
 import os
 import tempfile
-from typing import Dict, Any
+from typing import Any, Callable, Dict, Optional
 
 
 def _safe_viewport(cmd) -> tuple[int, int]:
@@ -19,12 +19,28 @@ def _safe_viewport(cmd) -> tuple[int, int]:
     return (0, 0)
 
 
+def _render_png(cmd, path: str) -> tuple[int, int]:
+    vpw, vph = _safe_viewport(cmd)
+    # Non-invasive capture: never resize the live viewport for AI snapshots.
+    # 1) Try prior framebuffer image (fast path, no redraw/mutation)
+    # 2) Fallback to current viewport render (still width=0,height=0)
+    try:
+        cmd.png(path, width=0, height=0, ray=0, quiet=1, prior=1)
+    except Exception:
+        cmd.png(path, width=0, height=0, ray=0, quiet=1, prior=0)
+    return (vpw, vph)
+
+
 def capture_viewer_snapshot(
     cmd,
     *,
     width: int = 1024,
     height: int = 0,
+    call_in_gui: Optional[Callable[[Callable[[], Any]], Any]] = None,
+    encode: bool = True,
 ) -> Dict[str, Any]:
+    # Only the render goes through call_in_gui; reading and encoding the file
+    # stay on the calling thread.
     fd = None
     path = None
     try:
@@ -34,32 +50,29 @@ def capture_viewer_snapshot(
 
         requested_width = max(0, int(width or 0))
         requested_height = max(0, int(height or 0))
-        vpw, vph = _safe_viewport(cmd)
-
-        # Non-invasive capture: never resize the live viewport for AI snapshots.
-        # 1) Try prior framebuffer image (fast path, no redraw/mutation)
-        # 2) Fallback to current viewport render (still width=0,height=0)
-        try:
-            cmd.png(path, width=0, height=0, ray=0, quiet=1, prior=1)
-        except Exception:
-            cmd.png(path, width=0, height=0, ray=0, quiet=1, prior=0)
+        render_path = path
+        if call_in_gui is None:
+            vpw, vph = _render_png(cmd, render_path)
+        else:
+            vpw, vph = call_in_gui(lambda: _render_png(cmd, render_path))
 
         with open(path, "rb") as handle:
             blob = handle.read()
 
-        data_url = "data:image/png;base64," + base64.b64encode(blob).decode("ascii")
-
-        return {
-            "ok": True,
-            "image_data_url": data_url,
-            "meta": {
-                "width": vpw if vpw > 0 else requested_width,
-                "height": vph if vph > 0 else requested_height,
-                "bytes": len(blob),
-                "requested_width": requested_width,
-                "requested_height": requested_height,
-            },
+        meta = {
+            "width": vpw if vpw > 0 else requested_width,
+            "height": vph if vph > 0 else requested_height,
+            "bytes": len(blob),
+            "requested_width": requested_width,
+            "requested_height": requested_height,
         }
+        if not encode:
+            # Callers that only need the raw PNG skip the base64 pass.
+            meta["bytes_data"] = blob
+            return {"ok": True, "image_data_url": "", "meta": meta}
+
+        data_url = "data:image/png;base64," + base64.b64encode(blob).decode("ascii")
+        return {"ok": True, "image_data_url": data_url, "meta": meta}
     except Exception as exc:  # noqa: BLE001
         return {
             "ok": False,
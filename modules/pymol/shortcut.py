@@ -16,6 +16,10 @@ from typing import Iterable, Optional, Union
 from collections import defaultdict
 from pymol import parsing
 
+# Bound on memoized prefix searches per Shortcut; the cache is simply reset
+# when full since sessions reuse a small set of command prefixes.
+_PREFIX_CACHE_SIZE = 256
+
 
 class Shortcut:
     def __init__(
@@ -32,6 +36,7 @@ class Shortcut:
         )
         self.shortcut: dict[str, Union[str, int]] = {}
         self.abbreviation_dict = defaultdict(list)
+        self._prefix_cache: dict[str, tuple[str, ...]] = {}
 
         for keyword in self.keywords:
             self._optimize_symbols(keyword)
@@ -125,6 +130,7 @@ class Shortcut:
                 self.shortcut[abbreviation] = keywords[0]
         for keyword in self.keywords:
             self.shortcut[keyword] = keyword
+        self._prefix_cache.clear()
 
     def interpret(
         self, keyword: str, mode: bool = False
@@ -144,24 +150,34 @@ class Shortcut:
         if result and not mode:
             return result
 
-        # prefix search
+        matches = self._prefix_cache.get(keyword)
+        if matches is None:
+            matches = self._prefix_search(keyword)
+            if len(self._prefix_cache) >= _PREFIX_CACHE_SIZE:
+                self._prefix_cache.clear()
+            self._prefix_cache[keyword] = matches
+
+        # no match
+        if not matches:
+            return
+
+        # single match: str
+        # multiple matches: list (a fresh copy, callers may sort it)
+        return matches[0] if len(matches) == 1 else list(matches)
+
+    def _prefix_search(self, keyword: str) -> tuple[str, ...]:
+        """
+        Returns every keyword that starts with `keyword` or has an
+        abbreviation starting with it. The result is cached by `interpret`
+        until the keyword set changes.
+        """
         unique_keywords = set(
             word for word in self.keywords if word.startswith(keyword)
         )
         for abbreviation, keywords in self.abbreviation_dict.items():
             if abbreviation.startswith(keyword):
                 unique_keywords.update(keywords)
-        # no match
-        if not unique_keywords:
-            return
-
-        # single match: str
-        # multiple matches: list
-        return (
-            unique_keywords.pop()
-            if len(unique_keywords) == 1
-            else list(unique_keywords)
-        )
+        return tuple(unique_keywords)
 
     def append(self, keyword: str) -> None:
         """Adds a new keyword to the list and rebuilds the shortcuts."""
@@ -1,5 +1,6 @@
 from pathlib import Path
 import sys
+from types import MappingProxyType, SimpleNamespace
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[3] / "modules"))
 
@@ -162,3 +163,21 @@ def test_empty_chats_are_not_listed(tmp_path):
     store.append_events(chat_id, [{"role": "user", "text": "hello", "metadata": {}}])
     store.flush_now()
     assert store.count_chats() == 1
+
+
+def test_append_events_persists_read_only_metadata_as_dict(tmp_path):
+    store = _store(tmp_path)
+    chat_id = store.create_chat("zoom")
+    event = SimpleNamespace(
+        role=SimpleNamespace(value="tool_result"),
+        text="Executed: zoom",
+        ok=True,
+        metadata=MappingProxyType({"tool_name": "run_pymol_command", "tool_command": "zoom"}),
+    )
+
+    assert store.append_events(chat_id, [event]) == 1
+    store.pump(_save_stub)
+
+    saved = store.load_chat(chat_id)["events"][0]
+    assert saved["role"] == "tool_result"
+    assert saved["metadata"] == {"tool_name": "run_pymol_command", "tool_command": "zoom"}
@@ -461,6 +461,46 @@ def test_run_turn_emits_external_tool_results_from_user_message(monkeypatch):
     FakeClient.messages = None
 
 
+def _raw_stream_event(data):
+    message = StreamEvent.__new__(StreamEvent)
+    message.event = data
+    return message
+
+
+def test_run_turn_parses_streamed_tool_input_only_when_needed(monkeypatch):
+    monkeypatch.setattr(sdk_loop_module, "_import_sdk_symbols", _symbols)
+    FakeClient.messages = [
+        _raw_stream_event({"type": "content_block_start", "content_block": {"type": "tool_use", "id": "toolu_2", "name": "Bash"}}),
+        _raw_stream_event({"type": "content_block_delta", "delta": {"type": "input_json_delta", "partial_json": '{"command": '}}),
+        _raw_stream_event({"type": "content_block_delta", "delta": {"type": "input_json_delta", "partial_json": '"ls"}'}}),
+        _raw_stream_event({"type": "content_block_stop"}),
+        UserMessage(parent_tool_use_id="toolu_2", tool_use_result={"stdout": "a.pdb"}, content=[]),
+        ResultMessage(session_id="sess_new"),
+    ]
+    emitted = []
+
+    loop = ClaudeSdkLoop()
+    result = loop.run_turn(
+        prompt="test",
+        model="anthropic/claude-sonnet-4",
+        system_prompt="sys",
+        max_turns=4,
+        max_buffer_size=None,
+        resume_session_id=None,
+        on_text_chunk=lambda _t: None,
+        on_message_boundary=lambda: None,
+        on_reasoning_chunk=None,
+        on_tool_result=lambda tool_id, name, args, output, is_error: emitted.append((tool_id, name, args)),
+        should_cancel=lambda: False,
+        run_command_tool=lambda _id, _args: {"ok": True},
+        snapshot_tool=lambda _id, _args: {"ok": True},
+    )
+
+    assert result.error is None
+    assert emitted == [("toolu_2", "Bash", {"command": "ls"})]
+    FakeClient.messages = None
+
+
 def test_snapshot_tool_returns_image_content_shape(monkeypatch):
     monkeypatch.setattr(sdk_loop_module, "_import_sdk_symbols", _symbols)
     loop = ClaudeSdkLoop()
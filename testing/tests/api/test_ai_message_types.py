@@ -0,0 +1,47 @@
+import pytest
+
+from pymol.ai.message_types import ToolCall, UiEvent, UiRole
+
+
+def test_tool_call_precomputes_canonical_arguments():
+    call = ToolCall(tool_call_id="t1", name="run_pymol_command", arguments={"b": 1, "a": "x"})
+    assert call.arguments_json == '{"a":"x","b":1}'
+
+    wire = ToolCall(
+        tool_call_id="t2",
+        name="run_pymol_command",
+        arguments={"a": "x", "b": 1},
+        arguments_json='{"b": 1, "a": "x"}',
+    )
+    assert wire.arguments_json == '{"b": 1, "a": "x"}'
+    assert wire.args_key == call.args_key
+    assert ToolCall(tool_call_id="t3", name="other", arguments={"a": "x", "b": 1}).args_key != call.args_key
+
+
+def test_tool_call_is_frozen():
+    call = ToolCall(tool_call_id="t1", name="run_pymol_command", arguments={})
+    assert call.arguments_json == "{}"
+    with pytest.raises(AttributeError):
+        call.name = "changed"
+
+
+def test_ui_role_hashes_like_its_string_value():
+    assert hash(UiRole.SYSTEM) == hash("system")
+    assert {UiRole.TOOL_RESULT: 1}["tool_result"] == 1
+    assert UiRole("ai") is UiRole.AI
+
+
+def test_ui_event_metadata_is_read_only():
+    event = UiEvent(role=UiRole.TOOL_RESULT, text="ok", metadata={"tool_name": "run_pymol_command"})
+    assert event.metadata["tool_name"] == "run_pymol_command"
+    assert dict(event.metadata) == {"tool_name": "run_pymol_command"}
+    with pytest.raises(TypeError):
+        event.metadata["tool_name"] = "other"
+    assert dict(UiEvent(role=UiRole.AI, text="").metadata) == {}
+
+
+def test_ui_event_metadata_wraps_source_dict_without_copying():
+    source = {"tool_name": "run_pymol_command"}
+    event = UiEvent(role=UiRole.TOOL_RESULT, text="ok", metadata=source)
+    source["tool_name"] = "other"
+    assert event.metadata["tool_name"] == "other"
@@ -1,5 +1,10 @@
+import base64
+import itertools
+import os
 from types import SimpleNamespace
 
+import pytest
+
 from pymol.ai import runtime as runtime_module
 from pymol.ai.api_key_store import ApiKeyStatus
 from pymol.ai.openbio_api_key_store import ApiKeyStatus as OpenBioApiKeyStatus
@@ -7,6 +12,14 @@ from pymol.ai.message_types import UiEvent, UiRole
 from pymol.ai.runtime import AiRuntime
 from pymol.shortcut import Shortcut
 
+# Read-only in these tests, so one keyword index serves every DummyCmd.
+_KWHASH = Shortcut(["show", "hide", "color", "zoom", "fetch", "select"])
+_NOOP_PYMOL = SimpleNamespace()
+
+
+def _inline(fn):
+    return fn()
+
 
 class DummyParser:
     def __init__(self):
@@ -19,11 +32,13 @@ class DummyParser:
 
 class DummyCmd:
     def __init__(self):
-        self.kwhash = Shortcut(["show", "hide", "color", "zoom", "fetch", "select"])
+        self.kwhash = _KWHASH
         self._parser = DummyParser()
-        self._pymol = SimpleNamespace()
-        self._call_in_gui_thread = lambda fn: fn()
+        self._pymol = _NOOP_PYMOL
+        self._call_in_gui_thread = _inline
+        self._snapshot_counter = itertools.count(1)
         self._snapshot_idx = 0
+        self._last_png_bytes = b""
 
     def get_names(self, type_name, enabled_only=0):
         if type_name == "objects":
@@ -48,9 +63,66 @@ class DummyCmd:
         return ["obj1"]
 
     def png(self, path, width=0, height=0, ray=0, quiet=1, prior=0):
-        self._snapshot_idx += 1
+        # A few bytes are enough for the capture to read back and encode.
+        self._snapshot_idx = next(self._snapshot_counter)
+        self._last_png_bytes = b"\x89PNG\r\n\x1a\n" + bytes([self._snapshot_idx])
         with open(path, "wb") as handle:
-            handle.write(b"\x89PNG\r\n\x1a\n" + bytes([self._snapshot_idx]))
+            handle.write(self._last_png_bytes)
+
+
+def _fake_sdk_tool_run(action, kwargs):
+    kwargs["run_command_tool"](action.get("id", "call_run"), action.get("args", {}))
+
+
+def _fake_sdk_tool_snapshot(action, kwargs):
+    kwargs["snapshot_tool"](action.get("id", "call_snapshot"), action.get("args", {}))
+
+
+def _fake_sdk_openbio(action, kwargs):
+    cb = kwargs.get("openbio_api_tool")
+    if cb:
+        cb(
+            action.get("id", "call_openbio"),
+            action.get("tool_name", "openbio_api_health"),
+            action.get("args", {}),
+        )
+
+
+def _fake_sdk_external(action, kwargs):
+    cb = kwargs.get("on_tool_result")
+    if cb:
+        cb(
+            action.get("id", "external_call"),
+            action.get("tool_name", ""),
+            action.get("args", {}),
+            action.get("result"),
+            action.get("is_error"),
+        )
+
+
+def _fake_sdk_stream(action, kwargs):
+    kwargs["on_text_chunk"](action.get("text", ""))
+
+
+def _fake_sdk_reason(action, kwargs):
+    cb = kwargs.get("on_reasoning_chunk")
+    if cb:
+        cb(action.get("text", ""))
+
+
+def _fake_sdk_call(action, kwargs):
+    action["fn"]()
+
+
+_FAKE_SDK_HANDLERS = {
+    "tool_run": _fake_sdk_tool_run,
+    "tool_snapshot": _fake_sdk_tool_snapshot,
+    "openbio_tool": _fake_sdk_openbio,
+    "external_tool_result": _fake_sdk_external,
+    "stream": _fake_sdk_stream,
+    "reason": _fake_sdk_reason,
+    "call": _fake_sdk_call,
+}
 
 
 class FakeSdkLoop:
@@ -70,34 +142,7 @@ class FakeSdkLoop:
         plan = self._plans.pop(0) if self._plans else {"assistant_text": "", "session_id": None}
 
         for action in plan.get("actions") or []:
-            if action["kind"] == "tool_run":
-                kwargs["run_command_tool"](action.get("id", "call_run"), action.get("args", {}))
-            elif action["kind"] == "tool_snapshot":
-                kwargs["snapshot_tool"](action.get("id", "call_snapshot"), action.get("args", {}))
-            elif action["kind"] == "openbio_tool":
-                cb = kwargs.get("openbio_api_tool")
-                if cb:
-                    cb(
-                        action.get("id", "call_openbio"),
-                        action.get("tool_name", "openbio_api_health"),
-                        action.get("args", {}),
-                    )
-            elif action["kind"] == "external_tool_result":
-                cb = kwargs.get("on_tool_result")
-                if cb:
-                    cb(
-                        action.get("id", "external_call"),
-                        action.get("tool_name", ""),
-                        action.get("args", {}),
-                        action.get("result"),
-                        action.get("is_error"),
-                    )
-            elif action["kind"] == "stream":
-                kwargs["on_text_chunk"](action.get("text", ""))
-            elif action["kind"] == "reason":
-                cb = kwargs.get("on_reasoning_chunk")
-                if cb:
-                    cb(action.get("text", ""))
+            _FAKE_SDK_HANDLERS[action["kind"]](action, kwargs)
 
         return SimpleNamespace(
             assistant_text=plan.get("assistant_text", ""),
@@ -109,28 +154,73 @@ class FakeSdkLoop:
         )
 
 
-def _runtime(monkeypatch):
-    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
-    monkeypatch.delenv("PYMOL_AI_DISABLE", raising=False)
-    monkeypatch.setenv("PYMOL_AI_REASONING_DEFAULT", "0")
-    monkeypatch.setenv("PYMOL_AI_CONVERSATION_MODE", "local_first")
-    runtime = AiRuntime(DummyCmd())
+@pytest.fixture(scope="module")
+def shared_cmd():
+    return DummyCmd()
+
+
+@pytest.fixture
+def cmd(shared_cmd):
+    shared_cmd._parser.commands.clear()
+    shared_cmd._snapshot_counter = itertools.count(1)
+    shared_cmd._snapshot_idx = 0
+    shared_cmd._last_png_bytes = b""
+    # Drop per-test overrides such as a failing png stub.
+    shared_cmd.__dict__.pop("png", None)
+    return shared_cmd
+
+
+def _patch_env(monkeypatch, **overrides):
+    # One throwaway copy of the environment per test; None removes a key.
+    env = dict(os.environ)
+    for key, value in overrides.items():
+        if value is None:
+            env.pop(key, None)
+        else:
+            env[key] = value
+    monkeypatch.setattr(os, "environ", env)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def _runtime_env():
+    # Baseline environment patched once per module; tests layer overrides on top
+    # with _patch_env(monkeypatch, ...), which is undone before the next test.
+    # The API key is passed to AiRuntime directly, so none is left in the env.
+    mp = pytest.MonkeyPatch()
+    _patch_env(
+        mp,
+        OPENROUTER_API_KEY=None,
+        ANTHROPIC_AUTH_TOKEN=None,
+        PYMOL_AI_DISABLE=None,
+        PYMOL_AI_REASONING_DEFAULT="0",
+        PYMOL_AI_CONVERSATION_MODE="local_first",
+    )
+    yield
+    mp.undo()
+
+
+def _runtime(cmd):
+    runtime = AiRuntime(cmd, api_key="test-key")
     runtime.set_ui_mode("qt")
     return runtime
 
 
+@pytest.fixture
+def runtime(cmd):
+    # A fresh AiRuntime per test: it owns queues, locks and per-turn caches that
+    # would otherwise leak between tests. The expensive parts (env, cmd) are shared.
+    return _runtime(cmd)
+
+
 def _events(runtime):
     return runtime.drain_ui_events()
 
 
-def test_runtime_bootstraps_saved_api_key(monkeypatch):
-    monkeypatch.delenv("OPENROUTER_API_KEY", raising=False)
-    monkeypatch.delenv("ANTHROPIC_AUTH_TOKEN", raising=False)
-    monkeypatch.setenv("PYMOL_AI_REASONING_DEFAULT", "0")
-    monkeypatch.setenv("PYMOL_AI_CONVERSATION_MODE", "local_first")
+def test_runtime_bootstraps_saved_api_key(monkeypatch, cmd):
+    _patch_env(monkeypatch, OPENROUTER_API_KEY=None, ANTHROPIC_AUTH_TOKEN=None)
 
     def fake_load():
-        monkeypatch.setenv("OPENROUTER_API_KEY", "saved-key-1234")
+        os.environ["OPENROUTER_API_KEY"] = "saved-key-1234"
         return ApiKeyStatus(
             has_key=True,
             source="saved",
@@ -140,7 +230,7 @@ def test_runtime_bootstraps_saved_api_key(monkeypatch):
 
     monkeypatch.setattr(runtime_module, "load_saved_key_into_env_if_needed", fake_load)
 
-    runtime = AiRuntime(DummyCmd())
+    runtime = AiRuntime(cmd)
     runtime.set_ui_mode("qt")
 
     assert runtime.enabled is True
@@ -148,14 +238,11 @@ def test_runtime_bootstraps_saved_api_key(monkeypatch):
     assert runtime._api_key_source == "saved"
 
 
-def test_runtime_bootstraps_saved_openbio_api_key(monkeypatch):
-    monkeypatch.delenv("OPENBIO_API_KEY", raising=False)
-    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
-    monkeypatch.setenv("PYMOL_AI_REASONING_DEFAULT", "0")
-    monkeypatch.setenv("PYMOL_AI_CONVERSATION_MODE", "local_first")
+def test_runtime_bootstraps_saved_openbio_api_key(monkeypatch, cmd):
+    _patch_env(monkeypatch, OPENBIO_API_KEY=None)
 
     def fake_load_openbio():
-        monkeypatch.setenv("OPENBIO_API_KEY", "saved-openbio-key-1234")
+        os.environ["OPENBIO_API_KEY"] = "saved-openbio-key-1234"
         return OpenBioApiKeyStatus(
             has_key=True,
             source="saved",
@@ -165,15 +252,13 @@ def test_runtime_bootstraps_saved_openbio_api_key(monkeypatch):
 
     monkeypatch.setattr(runtime_module, "load_openbio_saved_key_into_env_if_needed", fake_load_openbio)
 
-    runtime = AiRuntime(DummyCmd())
-    runtime.set_ui_mode("qt")
+    runtime = _runtime(cmd)
 
     assert runtime._openbio_api_key == "saved-openbio-key-1234"
     assert runtime._openbio_api_key_source == "saved"
 
 
-def test_drain_ui_events_limit_preserves_remainder(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_drain_ui_events_limit_preserves_remainder(runtime):
     runtime.emit_ui_event(UiEvent(role=UiRole.SYSTEM, text="one"))
     runtime.emit_ui_event(UiEvent(role=UiRole.SYSTEM, text="two"))
     runtime.emit_ui_event(UiEvent(role=UiRole.SYSTEM, text="three"))
@@ -187,8 +272,29 @@ def test_drain_ui_events_limit_preserves_remainder(monkeypatch):
     assert not runtime.has_pending_ui_events()
 
 
-def test_ui_event_queue_compaction_prefers_low_priority_drop(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_iter_drain_ui_events_pops_lazily(runtime):
+    for text in ("one", "two", "three"):
+        runtime.emit_ui_event(UiEvent(role=UiRole.TOOL_RESULT, text=text))
+
+    it = runtime.iter_drain_ui_events()
+    assert next(it).text == "one"
+    it.close()
+    assert [e.text for e in runtime.iter_drain_ui_events(limit=1)] == ["two"]
+    assert [e.text for e in runtime.drain_ui_events()] == ["three"]
+
+
+def test_emit_ui_events_batch_filters_and_preserves_order(runtime):
+    runtime.emit_ui_events(
+        [
+            UiEvent(role=UiRole.SYSTEM, text="one"),
+            UiEvent(role=UiRole.SYSTEM, text="Validation required: hidden"),
+            UiEvent(role=UiRole.AI, text="two"),
+        ]
+    )
+    assert [e.text for e in _events(runtime)] == ["one", "two"]
+
+
+def test_ui_event_queue_compaction_prefers_low_priority_drop(runtime):
     runtime.ui_max_events = 3
 
     runtime.emit_ui_event(UiEvent(role=UiRole.SYSTEM, text="s1"))
@@ -204,8 +310,19 @@ def test_ui_event_queue_compaction_prefers_low_priority_drop(monkeypatch):
     assert any("compacted to keep UI responsive" in t for t in texts)
 
 
-def test_ai_controls_model_clear_and_mode(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_ui_event_queue_compaction_keeps_fifo_order(runtime):
+    runtime.ui_max_events = 3
+
+    runtime.emit_ui_event(UiEvent(role=UiRole.USER, text="u1"))
+    runtime.emit_ui_event(UiEvent(role=UiRole.REASONING, text="r1"))
+    runtime.emit_ui_event(UiEvent(role=UiRole.AI, text="a1"))
+    runtime.emit_ui_event(UiEvent(role=UiRole.SYSTEM, text="s1"))
+
+    texts = [e.text for e in _events(runtime)]
+    assert texts == ["u1", "a1", "chat output compacted to keep UI responsive"]
+
+
+def test_ai_controls_model_clear_and_mode(runtime):
     runtime.history = [{"role": "user", "content": "hello"}]
     runtime.input_mode = "cli"
 
@@ -219,16 +336,14 @@ def test_ai_controls_model_clear_and_mode(monkeypatch):
     assert runtime.history == []
 
 
-def test_set_model_emits_notice_when_idle(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_set_model_emits_notice_when_idle(runtime):
     runtime.set_model("z-ai/glm-5", emit_notice=True)
     assert runtime.model == "z-ai/glm-5"
     events = _events(runtime)
     assert any(e.role == UiRole.SYSTEM and e.text == "Model set to z-ai/glm-5." for e in events)
 
 
-def test_set_model_emits_next_turn_notice_when_busy(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_set_model_emits_next_turn_notice_when_busy(runtime):
     with runtime._lock:
         runtime._busy = True
     runtime.set_model("google/gemini-3-flash-preview", emit_notice=True)
@@ -242,29 +357,36 @@ def test_set_model_emits_next_turn_notice_when_busy(monkeypatch):
     )
 
 
-def test_clear_session_api(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_clear_session_api(runtime):
     runtime.history = [{"role": "user", "content": "hello"}]
-    runtime._stream_line_buffer = "partial"
-    runtime._recent_tool_results = [{"command": "zoom", "ok": True, "error": ""}]
+    runtime._stream_line_parts.append("partial")
+    runtime._remember_tool_result("zoom", True, "")
     runtime._sdk_session_id = "abc"
     old_query_session_id = runtime._chat_query_session_id
 
     runtime.clear_session(emit_notice=False)
     assert runtime.history == []
-    assert runtime._stream_line_buffer == ""
-    assert runtime._recent_tool_results == []
+    assert runtime._stream_line_parts == []
+    assert len(runtime._recent_tool_results) == 0
     assert runtime._sdk_session_id is None
     assert runtime._chat_query_session_id != old_query_session_id
-    assert _events(runtime) == []
+    assert _events(runtime) == ()
 
     runtime.clear_session(emit_notice=True)
     events = _events(runtime)
     assert any(e.role == UiRole.SYSTEM and "session memory cleared" in e.text for e in events)
 
 
-def test_ensure_ai_default_mode(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_recent_tool_results_are_capped(monkeypatch, cmd):
+    _patch_env(monkeypatch, PYMOL_AI_RECENT_TOOL_RESULTS="3")
+    runtime = _runtime(cmd)
+    for idx in range(5):
+        runtime._remember_tool_result("cmd%d" % idx, True, "")
+
+    assert [r["command"] for r in runtime._recent_tool_results] == ["cmd2", "cmd3", "cmd4"]
+
+
+def test_ensure_ai_default_mode(runtime):
     runtime.input_mode = "cli"
     runtime.enabled = False
 
@@ -274,8 +396,7 @@ def test_ensure_ai_default_mode(monkeypatch):
     assert runtime.enabled is True
 
 
-def test_export_import_session_state_roundtrip(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_export_import_session_state_roundtrip(runtime, cmd):
     runtime.input_mode = "cli"
     runtime.history = [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "hi"}]
     runtime.model = "openai/test"
@@ -293,7 +414,7 @@ def test_export_import_session_state_roundtrip(monkeypatch):
     assert state["conversation_mode"] == "hybrid_resume"
     assert state["chat_query_session_id"] == "chat_scope_1"
 
-    restored = _runtime(monkeypatch)
+    restored = _runtime(cmd)
     restored.import_session_state(state, apply_model=False)
     assert restored.input_mode == "cli"
     assert restored.history == runtime.history
@@ -305,23 +426,30 @@ def test_export_import_session_state_roundtrip(monkeypatch):
     assert restored.reasoning_visible is True
 
 
-def test_runtime_events_and_history_do_not_expose_api_key(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_runtime_events_and_history_do_not_expose_api_key(runtime):
     runtime.handle_typed_input("/ai")
     events = _events(runtime)
-    serialized = repr(events) + repr(runtime.history) + repr(runtime.export_session_state())
-    assert "test-key" not in serialized
+    assert not runtime_module._contains_secret(
+        (events, runtime.history, runtime.export_session_state()),
+        "test-key",
+    )
+
+
+def test_explicit_api_key_is_not_written_to_environment(runtime):
+    assert runtime.enabled is True
+    assert runtime._api_key_source == "argument"
+    assert "test-key" not in os.environ.values()
+    assert runtime._sdk_loop.map_openrouter_env()["ANTHROPIC_AUTH_TOKEN"] == "test-key"
 
 
-def test_missing_api_key_does_not_enable(monkeypatch):
-    monkeypatch.delenv("OPENROUTER_API_KEY", raising=False)
-    monkeypatch.delenv("ANTHROPIC_AUTH_TOKEN", raising=False)
+def test_missing_api_key_does_not_enable(monkeypatch, cmd):
+    _patch_env(monkeypatch, OPENROUTER_API_KEY=None, ANTHROPIC_AUTH_TOKEN=None)
     monkeypatch.setattr(
         runtime_module,
         "load_saved_key_into_env_if_needed",
         lambda: ApiKeyStatus(has_key=False, source="none", masked_key="", keyring_available=True),
     )
-    runtime = AiRuntime(DummyCmd())
+    runtime = AiRuntime(cmd)
     runtime.set_ui_mode("qt")
 
     runtime.handle_typed_input("/ai")
@@ -335,8 +463,15 @@ def test_missing_api_key_does_not_enable(monkeypatch):
     assert any("OPENROUTER_API_KEY (or ANTHROPIC_AUTH_TOKEN) is not set" in e.text for e in _events(runtime))
 
 
-def test_ai_mode_routes_text_to_agent(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_disabled_ai_consumes_input_with_message(runtime):
+    runtime.enabled = False
+    assert runtime.handle_typed_input("color red, all please") is True
+    events = _events(runtime)
+    assert (events[-1].role, events[-1].text) == (UiRole.ERROR, runtime_module._DISABLED_MESSAGE)
+    assert not runtime.cmd._parser.commands
+
+
+def test_ai_mode_routes_text_to_agent(runtime):
     calls = []
     runtime._start_agent_request = lambda prompt: calls.append(prompt)
 
@@ -344,8 +479,7 @@ def test_ai_mode_routes_text_to_agent(monkeypatch):
     assert calls == ["show cartoon"]
 
 
-def test_cli_mode_and_one_off(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_cli_mode_and_one_off(runtime):
 
     runtime.handle_typed_input("/cli")
     assert runtime.input_mode == "cli"
@@ -358,8 +492,7 @@ def test_cli_mode_and_one_off(monkeypatch):
     assert runtime.cmd._parser.commands[-1] == "fetch 1bom"
 
 
-def test_sdk_path_emits_stream_and_tool_metadata(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_sdk_path_emits_stream_and_tool_metadata(runtime):
     runtime.screenshot_validate_required = False
     runtime._sdk_loop = FakeSdkLoop(
         [
@@ -387,8 +520,43 @@ def test_sdk_path_emits_stream_and_tool_metadata(monkeypatch):
     assert runtime._sdk_session_id == "sess_a"
 
 
-def test_sdk_turn_uses_selected_model(monkeypatch):
-    runtime = _runtime(monkeypatch)
+@pytest.mark.parametrize("skip_enabled", [False, True])
+def test_duplicate_read_only_command_in_turn_is_skipped_only_when_enabled(runtime, skip_enabled):
+    runtime.screenshot_validate_required = False
+    runtime.skip_duplicate_commands = skip_enabled
+    commands = [
+        "get_view",
+        "GET_VIEW",
+        "turn y, 90",
+        "turn y, 90",
+        "get_view",
+        "remove chain B",
+        "zoom",
+        "zoom",
+    ]
+    runtime._sdk_loop = FakeSdkLoop(
+        [
+            {
+                "actions": [
+                    {"kind": "tool_run", "id": "tool_%d" % idx, "args": {"command": command}}
+                    for idx, command in enumerate(commands)
+                ],
+                "assistant_text": "Done.",
+                "session_id": "sess_dup",
+            }
+        ]
+    )
+
+    runtime._agent_worker("look around")
+
+    skipped = [1] if skip_enabled else []
+    expected = [c for idx, c in enumerate(commands) if idx not in skipped]
+    assert runtime.cmd._parser.commands == expected
+    tool_events = [e for e in _events(runtime) if e.role == UiRole.TOOL_RESULT]
+    assert [idx for idx, e in enumerate(tool_events) if e.metadata["tool_result_json"].get("skipped")] == skipped
+
+
+def test_sdk_turn_uses_selected_model(runtime):
     runtime.model = "minimax/minimax-m2.5"
     runtime.screenshot_validate_required = False
     runtime._sdk_loop = FakeSdkLoop(
@@ -406,8 +574,7 @@ def test_sdk_turn_uses_selected_model(monkeypatch):
     assert runtime._sdk_loop.calls[0]["model"] == "minimax/minimax-m2.5"
 
 
-def test_stream_only_output_does_not_emit_missing_final_error(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_stream_only_output_does_not_emit_missing_final_error(runtime):
     runtime.screenshot_validate_required = False
     runtime._sdk_loop = FakeSdkLoop(
         [
@@ -431,8 +598,7 @@ def test_stream_only_output_does_not_emit_missing_final_error(monkeypatch):
     assert "Loaded 5del successfully." in str(runtime.history[-1]["content"])
 
 
-def test_iteration_cap_emits_continue_prompt(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_iteration_cap_emits_continue_prompt(runtime):
     runtime.screenshot_validate_required = False
     runtime._sdk_loop = FakeSdkLoop(
         [
@@ -457,8 +623,7 @@ def test_iteration_cap_emits_continue_prompt(monkeypatch):
     )
 
 
-def test_stream_chunks_emit_progress_without_newline(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_stream_chunks_emit_progress_without_newline(runtime):
     runtime._on_assistant_chunk("12345")
     first = _events(runtime)
     assert len(first) == 1
@@ -470,8 +635,48 @@ def test_stream_chunks_emit_progress_without_newline(monkeypatch):
     assert any(e.role == UiRole.AI and e.text == "67890" for e in events)
 
 
-def test_sdk_fail_fast_no_fallback(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_stream_chunks_coalesce_until_newline_or_next_event(runtime):
+    runtime.stream_flush_interval = 60.0
+    runtime._on_assistant_chunk("Load")
+    runtime._on_assistant_chunk("ing ")
+    runtime._on_assistant_chunk("1ubq")
+    runtime._on_assistant_chunk("...\n")
+    runtime._on_assistant_chunk("Done")
+    runtime.emit_ui_event(UiEvent(role=UiRole.TOOL_RESULT, text="ok"))
+
+    events = _events(runtime)
+    assert [(e.role, e.text) for e in events] == [
+        (UiRole.AI, "Load"),
+        (UiRole.AI, "ing 1ubq...\n"),
+        (UiRole.AI, "Done"),
+        (UiRole.TOOL_RESULT, "ok"),
+    ]
+
+
+def test_buffered_stream_text_counts_as_pending(runtime):
+    runtime.stream_flush_interval = 60.0
+    runtime._on_assistant_chunk("Load")
+    assert [e.text for e in _events(runtime)] == ["Load"]
+
+    runtime._on_assistant_chunk("ing")
+    assert runtime.has_pending_ui_events()
+    assert [e.text for e in _events(runtime)] == ["ing"]
+    assert not runtime.has_pending_ui_events()
+
+
+def test_drained_stream_text_is_printed_in_text_mode(runtime, capsys):
+    runtime.set_ui_mode("text")
+    runtime.stream_flush_interval = 60.0
+    runtime._on_assistant_chunk("Load")
+    runtime.drain_ui_events()
+    runtime._on_assistant_chunk("ing")
+    capsys.readouterr()
+
+    assert [e.text for e in runtime.drain_ui_events()] == ["ing"]
+    assert capsys.readouterr().out == "AI> ing\n"
+
+
+def test_sdk_fail_fast_no_fallback(runtime):
     runtime._sdk_loop = FakeSdkLoop(
         [{"error": "provider failed", "error_class": "sdk_error", "assistant_text": "", "session_id": None}]
     )
@@ -481,8 +686,7 @@ def test_sdk_fail_fast_no_fallback(monkeypatch):
     assert any(e.role == UiRole.ERROR and "provider failed" in e.text for e in events)
 
 
-def test_resume_invalid_retries_with_context_bootstrap(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_resume_invalid_retries_with_context_bootstrap(runtime):
     runtime.history = [{"role": "assistant", "content": "previous"}]
     runtime._sdk_session_id = "old_session"
     runtime.conversation_mode = "hybrid_resume"
@@ -502,8 +706,7 @@ def test_resume_invalid_retries_with_context_bootstrap(monkeypatch):
     assert runtime._sdk_session_id == "new_session"
 
 
-def test_snapshot_auto_enforcement_when_missing(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_snapshot_auto_enforcement_when_missing(runtime):
     runtime.screenshot_validate_required = True
     runtime._sdk_loop = FakeSdkLoop(
         [
@@ -526,8 +729,15 @@ def test_snapshot_auto_enforcement_when_missing(monkeypatch):
     assert snapshot_events[0].metadata.get("tool_call_id") == "auto_capture_viewer_snapshot_1"
 
 
-def test_snapshot_failure_fallback_warning(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_snapshot_tool_reads_rendered_png(runtime, cmd):
+    payload, image_data_url, _ = runtime._execute_snapshot_tool()
+
+    assert payload["ok"] is True
+    assert payload["meta"]["bytes"] == len(cmd._last_png_bytes) > 0
+    assert image_data_url == "data:image/png;base64," + base64.b64encode(cmd._last_png_bytes).decode("ascii")
+
+
+def test_snapshot_failure_fallback_warning(runtime):
     runtime.screenshot_validate_required = True
 
     def failing_png(path, width=0, height=0, ray=0, quiet=1, prior=0):
@@ -556,8 +766,7 @@ def test_snapshot_failure_fallback_warning(monkeypatch):
     )
 
 
-def test_external_bash_tool_result_is_visible(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_external_bash_tool_result_is_visible(runtime):
     runtime.screenshot_validate_required = False
     runtime._sdk_loop = FakeSdkLoop(
         [
@@ -590,8 +799,7 @@ def test_external_bash_tool_result_is_visible(monkeypatch):
     assert "ffmpeg" in str(result_json)
 
 
-def test_cancel_request_stops_worker_cleanly(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_cancel_request_stops_worker_cleanly(runtime):
     runtime._sdk_loop = FakeSdkLoop([{"error": "cancelled", "error_class": "cancelled", "interrupted": True}])
     runtime.request_cancel()
 
@@ -601,8 +809,32 @@ def test_cancel_request_stops_worker_cleanly(monkeypatch):
     assert not any(e.role == UiRole.ERROR and "unexpected error" in e.text for e in events)
 
 
-def test_reasoning_hidden_by_default_optional(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_cancel_mid_turn_skips_remaining_tool_calls(runtime, cmd):
+    runtime._sdk_loop = FakeSdkLoop(
+        [
+            {
+                "actions": [
+                    {"kind": "tool_run", "id": "tool_1", "args": {"command": "zoom"}},
+                    {"kind": "call", "fn": runtime.request_cancel},
+                    {"kind": "tool_run", "id": "tool_2", "args": {"command": "show cartoon"}},
+                    {"kind": "tool_snapshot", "id": "snap_1", "args": {}},
+                ],
+                "error": "cancelled",
+                "error_class": "cancelled",
+                "interrupted": True,
+            }
+        ]
+    )
+
+    runtime._agent_worker("do work")
+    events = _events(runtime)
+    assert cmd._parser.commands == ["zoom"]
+    assert cmd._snapshot_idx == 0
+    assert [e.metadata.get("tool_call_id") for e in events if e.role == UiRole.TOOL_RESULT] == ["tool_1"]
+    assert sum(1 for e in events if e.role == UiRole.SYSTEM and e.text == "request cancelled") == 1
+
+
+def test_reasoning_hidden_by_default_optional(runtime):
     runtime._sdk_loop = FakeSdkLoop(
         [{"actions": [{"kind": "reason", "text": "thinking"}], "assistant_text": "done", "session_id": "s"}]
     )
@@ -620,13 +852,11 @@ def test_reasoning_hidden_by_default_optional(monkeypatch):
     assert any(e.role == UiRole.REASONING and "thinking2" in e.text for e in events)
 
 
-def test_default_max_agent_steps_is_high(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_default_max_agent_steps_is_high(runtime):
     assert runtime.max_agent_steps == 64
 
 
-def test_local_first_mode_uses_history_and_no_resume(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_local_first_mode_uses_history_and_no_resume(runtime):
     runtime.history = [
         {"role": "assistant", "content": "prior answer"},
         {"role": "tool", "name": "run_pymol_command", "content": '{"ok":true,"command":"zoom"}'},
@@ -645,8 +875,7 @@ def test_local_first_mode_uses_history_and_no_resume(monkeypatch):
     assert "tool[run_pymol_command]:" in call["prompt"]
 
 
-def test_conversation_mode_matrix(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_conversation_mode_matrix(runtime):
 
     runtime.conversation_mode = "resume_only"
     runtime._sdk_session_id = "sess_old"
@@ -664,10 +893,19 @@ def test_conversation_mode_matrix(monkeypatch):
     assert call["resume_session_id"] == "sess_old_2"
 
 
-def test_internal_system_reminders_not_visible(monkeypatch):
-    runtime = _runtime(monkeypatch)
+def test_conversation_mode_setter_normalizes(runtime):
+    runtime.conversation_mode = " Hybrid_Resume "
+    assert runtime.conversation_mode == "hybrid_resume"
+    assert runtime._conv_mode is runtime_module.ConvMode.HYBRID_RESUME
+    runtime.conversation_mode = "unknown"
+    assert runtime.conversation_mode == "local_first"
+    assert runtime._conv_mode is runtime_module.ConvMode.LOCAL_FIRST
+
+
+def test_internal_system_reminders_not_visible(runtime):
     runtime.emit_ui_event(UiEvent(role=UiRole.SYSTEM, text="Visual validation required now: call capture_viewer_snapshot before final answer."))
     runtime.emit_ui_event(UiEvent(role=UiRole.SYSTEM, text="Validation required: capture_viewer_snapshot must be called before final answer because scene-changing commands were executed."))
+    runtime.emit_ui_event(UiEvent(role=UiRole.SYSTEM, text="DOOM LOOP DETECTED: same command repeated 3 times."))
     runtime.emit_ui_event(UiEvent(role=UiRole.SYSTEM, text="AI mode enabled"))
 
     events = _events(runtime)
@@ -676,9 +914,9 @@ def test_internal_system_reminders_not_visible(monkeypatch):
     assert events[0].text == "AI mode enabled"
 
 
-def test_openbio_tools_not_available_without_openbio_key(monkeypatch):
-    monkeypatch.delenv("OPENBIO_API_KEY", raising=False)
-    runtime = _runtime(monkeypatch)
+def test_openbio_tools_not_available_without_openbio_key(monkeypatch, cmd):
+    _patch_env(monkeypatch, OPENBIO_API_KEY=None)
+    runtime = _runtime(cmd)
     runtime._sdk_loop = FakeSdkLoop([{"assistant_text": "ok", "session_id": "sess_no_openbio"}])
 
     runtime._agent_worker("list openbio tools")
@@ -687,9 +925,9 @@ def test_openbio_tools_not_available_without_openbio_key(monkeypatch):
     assert runtime._sdk_loop.calls[0].get("openbio_api_tool") is None
 
 
-def test_openbio_tool_execution_emits_tool_result_and_history(monkeypatch):
-    monkeypatch.setenv("OPENBIO_API_KEY", "openbio-test-key")
-    runtime = _runtime(monkeypatch)
+def test_openbio_tool_execution_emits_tool_result_and_history(monkeypatch, cmd):
+    _patch_env(monkeypatch, OPENBIO_API_KEY="openbio-test-key")
+    runtime = _runtime(cmd)
     runtime.screenshot_validate_required = False
     runtime._sdk_loop = FakeSdkLoop(
         [
@@ -733,3 +971,139 @@ def test_openbio_tool_execution_emits_tool_result_and_history(monkeypatch):
         m.get("role") == "tool" and m.get("name") == "openbio_api_list_tools"
         for m in runtime.history
     )
+
+
+def test_history_entries_export_as_plain_dicts(runtime, cmd):
+    runtime.screenshot_validate_required = False
+    runtime._sdk_loop = FakeSdkLoop(
+        [
+            {
+                "actions": [{"kind": "tool_run", "id": "tool_1", "args": {"command": "zoom"}}],
+                "assistant_text": "Done.",
+                "session_id": "sess_hist",
+            }
+        ]
+    )
+
+    runtime._agent_worker("zoom please")
+
+    assert runtime.history[0] == {"role": "user", "content": "zoom please"}
+    assert runtime.history[1].get("name") == "run_pymol_command"
+    state = runtime.export_session_state()
+    assert all(type(m) is dict for m in state["history"])
+    assert state["history"][1]["tool_call_id"] == "tool_1"
+
+    restored = _runtime(cmd)
+    restored.import_session_state(state)
+    assert restored.history == runtime.history
+
+
+def test_history_trim_is_batched_and_keeps_latest_entries(runtime):
+    runtime.history_max_messages = 4
+    history = runtime.history
+    for idx in range(9):
+        runtime._append_history(runtime_module.HistoryEntry(role="user", content="m%d" % idx))
+
+    assert runtime.history is history
+    assert [m["content"] for m in runtime.history] == ["m5", "m6", "m7", "m8"]
+    assert [m["content"] for m in runtime.export_session_state()["history"]] == ["m5", "m6", "m7", "m8"]
+
+
+def test_contains_secret_walks_nested_events():
+    event = UiEvent(role=UiRole.TOOL_RESULT, text="ok", metadata={"tool_args": {"token": ["abc-test-key"]}})
+    assert runtime_module._contains_secret([{"events": (event,)}], "test-key")
+    assert not runtime_module._contains_secret([{"events": (event,)}], "other-key")
+
+
+def test_system_prompt_follows_agent_mode(runtime):
+    runtime.screenshot_validate_required = False
+    runtime._sdk_loop = FakeSdkLoop([{"assistant_text": "a"}, {"assistant_text": "b"}, {"assistant_text": "c"}])
+
+    runtime._agent_worker("one")
+    runtime._agent_worker("two")
+    runtime.set_agent_mode("tutor")
+    runtime._agent_worker("three")
+
+    prompts = [call["system_prompt"] for call in runtime._sdk_loop.calls]
+    assert prompts[0] is prompts[1]
+    assert "Mode: Work" in prompts[0]
+    assert "Mode: Tutor" in prompts[2]
+
+
+@pytest.mark.parametrize("warn_sec, expected", [(0.0, 1), (-1.0, 0)])
+def test_long_tool_step_warns_once_per_turn(runtime, warn_sec, expected):
+    runtime.screenshot_validate_required = False
+    runtime.long_tool_warn_sec = warn_sec
+    runtime._sdk_loop = FakeSdkLoop(
+        [
+            {
+                "actions": [
+                    {"kind": "tool_run", "id": "tool_1", "args": {"command": "zoom"}},
+                    {"kind": "tool_run", "id": "tool_2", "args": {"command": "show cartoon"}},
+                ],
+                "assistant_text": "Done",
+            }
+        ]
+    )
+
+    runtime._agent_worker("go")
+    events = _events(runtime)
+    assert sum(1 for e in events if e.role == UiRole.SYSTEM and e.text.startswith("tool step took")) == expected
+
+
+def test_turn_history_is_visible_while_the_turn_runs(runtime):
+    runtime.screenshot_validate_required = False
+    seen_lengths = []
+    runtime._sdk_loop = FakeSdkLoop(
+        [
+            {
+                "actions": [
+                    {"kind": "tool_run", "id": "tool_1", "args": {"command": "zoom"}},
+                    {"kind": "tool_run", "id": "tool_2", "args": {"command": "show cartoon"}},
+                    {"kind": "call", "fn": lambda: seen_lengths.append(len(runtime.history))},
+                ],
+                "assistant_text": "Done.",
+            }
+        ]
+    )
+
+    runtime._agent_worker("go")
+
+    # Tool results reach runtime.history as they are produced, so a mid-turn
+    # session export already contains them.
+    assert seen_lengths == [3]
+    assert [m["role"] for m in runtime.history] == ["user", "tool", "tool", "assistant"]
+    assert [m.get("tool_call_id") for m in runtime.history[1:3]] == ["tool_1", "tool_2"]
+
+
+def test_state_summary_reused_until_a_command_runs(runtime, monkeypatch):
+    runtime.screenshot_validate_required = False
+    builds = []
+    real_build = runtime_module.build_viewer_state_snapshot
+
+    def counting_build(*args, **kwargs):
+        builds.append(1)
+        return real_build(*args, **kwargs)
+
+    monkeypatch.setattr(runtime_module, "build_viewer_state_snapshot", counting_build)
+    runtime._sdk_loop = FakeSdkLoop(
+        [
+            {
+                "actions": [
+                    {"kind": "tool_snapshot", "id": "snap_1", "args": {}},
+                    {"kind": "tool_snapshot", "id": "snap_2", "args": {}},
+                    {"kind": "tool_run", "id": "tool_1", "args": {"command": "zoom"}},
+                    {"kind": "tool_snapshot", "id": "snap_3", "args": {}},
+                ],
+                "assistant_text": "Done.",
+            },
+            {"assistant_text": "Again."},
+        ]
+    )
+
+    runtime._agent_worker("look")
+    # turn prompt + both pre-command snapshots share one build; the post-command snapshot rebuilds
+    assert len(builds) == 2
+
+    runtime._agent_worker("look again")
+    assert len(builds) == 3
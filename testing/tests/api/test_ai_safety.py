@@ -2,33 +2,66 @@ import pytest
 
 from pymol.ai.protocol import AiPlan
 from pymol.ai.safety import (
+    MAX_COMMANDS,
     PlanValidationError,
     is_destructive_command,
     validate_plan,
 )
 
 
-def test_plan_rejects_more_than_10_commands():
-    plan = AiPlan(summary="too many", commands=["zoom"] * 11)
+@pytest.fixture
+def make_plan():
+    # Fresh plan per call: validate_plan appends to plan.warnings.
+    def make(*commands, summary="plan"):
+        return AiPlan(summary=summary, commands=list(commands))
+
+    return make
+
+
+def test_plan_rejects_more_than_10_commands(make_plan):
+    plan = make_plan(*["zoom"] * 11)
     with pytest.raises(PlanValidationError):
         validate_plan(plan)
 
 
-def test_destructive_plan_is_flagged():
-    plan = AiPlan(summary="cleanup", commands=["delete all"])
+def test_oversized_plan_is_rejected_before_command_scan(make_plan):
+    plan = make_plan(*["/import os"] * (MAX_COMMANDS + 1))
+    with pytest.raises(PlanValidationError, match="limit is"):
+        validate_plan(plan)
+
+
+def test_destructive_plan_is_flagged(make_plan):
+    plan = make_plan("delete all")
     result = validate_plan(plan)
     assert result.destructive
     assert any("Destructive commands detected" in w for w in plan.warnings)
 
 
-def test_non_destructive_plan_not_flagged():
-    plan = AiPlan(summary="style", commands=["show cartoon"])
+def test_non_destructive_plan_not_flagged(make_plan):
+    plan = make_plan("show cartoon")
     result = validate_plan(plan)
     assert not result.destructive
     assert not is_destructive_command("show cartoon")
 
 
-def test_blocked_python_command_is_rejected():
-    plan = AiPlan(summary="unsafe", commands=["/import os"])
+def test_blocked_python_command_is_rejected(make_plan):
+    plan = make_plan("/import os")
     with pytest.raises(PlanValidationError):
         validate_plan(plan)
+
+
+@pytest.mark.parametrize(
+    "command, expected",
+    [
+        ("DELETE all", True),
+        ("  reset ", True),
+        ("reinitialize", True),
+        ("alter all, b=0", True),
+        ("deletes", False),
+        ("resetx view", False),
+        ("alter sele, b=0", False),
+        ("", False),
+    ],
+)
+def test_is_destructive_command_keywords(command, expected):
+    assert is_destructive_command(command) is expected
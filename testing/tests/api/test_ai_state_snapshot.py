@@ -1,9 +1,29 @@
-from types import SimpleNamespace
+from types import MappingProxyType
 
 from pymol.ai.state_snapshot import build_viewer_state_snapshot
 
+_COUNTS = MappingProxyType({"sel1": 10, "sel2": 5, "sel3": 2})
+_COUNTS_LARGE = MappingProxyType({**_COUNTS, "sel1": 1000})
+_ATOMS = MappingProxyType(
+    {
+        "sel1": (
+            "obj1/A//10/GLY/CA/1",
+            "obj1/A//10/GLY/N/2",
+            "obj1/A//10/GLY/C/3",
+        ),
+        "sel2": (
+            "obj1/A//20/SER/OG/4",
+            "obj1/A//20/SER/CB/5",
+        ),
+    }
+)
+_VIEW = (0.0,) * 18
+_VIEWPORT = (800, 600)
+
 
 class DummyCmd:
+    counts = _COUNTS
+
     def get_names(self, type_name, enabled_only=0):
         if type_name == "objects":
             return ["obj1", "obj2", "obj3"] if enabled_only == 0 else ["obj1"]
@@ -12,16 +32,16 @@ class DummyCmd:
         return []
 
     def count_atoms(self, selection):
-        return {"sel1": 10, "sel2": 5, "sel3": 2}.get(selection, 0)
+        return self.counts.get(selection, 0)
 
     def get_vis(self):
         return {"obj1": 1}
 
     def get_view(self, output=0, quiet=1):
-        return [0.0] * 18
+        return list(_VIEW)
 
     def get_viewport(self, output=0, quiet=1):
-        return [800, 600]
+        return list(_VIEWPORT)
 
     def get_object_list(self, selection="(all)", quiet=1):
         return ["obj1", "obj2"]
@@ -29,19 +49,8 @@ class DummyCmd:
     def iterate(self, selection, expression, space=None):
         space = space or {}
         out = space.setdefault("out", [])
-        atoms = {
-            "sel1": [
-                "obj1/A//10/GLY/CA/1",
-                "obj1/A//10/GLY/N/2",
-                "obj1/A//10/GLY/C/3",
-            ],
-            "sel2": [
-                "obj1/A//20/SER/OG/4",
-                "obj1/A//20/SER/CB/5",
-            ],
-        }
         key = str(selection).strip().strip("()")
-        out.extend(atoms.get(key, []))
+        out.extend(_ATOMS.get(key, ()))
 
 
 def test_snapshot_schema_and_limits():
@@ -56,11 +65,7 @@ def test_snapshot_schema_and_limits():
     assert snap["enabled_objects"] == ["obj1"]
     assert snap["selections"] == ["sel1", "sel2"]
     assert "selection_counts" in snap
-    assert snap["selection_atom_ids"]["sel1"] == [
-        "obj1/A//10/GLY/CA/1",
-        "obj1/A//10/GLY/N/2",
-        "obj1/A//10/GLY/C/3",
-    ]
+    assert snap["selection_atom_ids"]["sel1"] == list(_ATOMS["sel1"])
     assert snap["selection_atom_ids_truncated"]["sel1"] is True
     assert snap["selection_atom_ids_truncated"]["sel2"] is True
     assert "view" in snap
@@ -92,8 +97,7 @@ def test_snapshot_handles_empty_state():
 
 def test_snapshot_skips_large_selections_for_atom_details():
     class LargeSelCmd(DummyCmd):
-        def count_atoms(self, selection):
-            return {"sel1": 1000, "sel2": 5, "sel3": 2}.get(selection, 0)
+        counts = _COUNTS_LARGE
 
     snap = build_viewer_state_snapshot(
         LargeSelCmd(),
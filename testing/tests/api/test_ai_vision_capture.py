@@ -1,17 +1,57 @@
+import base64
+from io import BytesIO
+
+import pytest
+
+from pymol.ai import vision_capture
 from pymol.ai.vision_capture import capture_viewer_snapshot
 
+_PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
 
-class DummyCmdOk:
+
+class _PngSink:
+    # In-memory stand-in for the snapshot temp file. The doubles write here
+    # instead of to the path, and the capture's read-back is served from it.
     def __init__(self):
+        self.buffer = BytesIO()
+
+    def write(self, data):
+        # Same semantics as open(path, "wb"): drop whatever an earlier
+        # (possibly failed) write left behind.
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.buffer.write(data)
+
+    def open(self, path, mode="rb"):
+        return BytesIO(self.buffer.getvalue())
+
+
+@pytest.fixture
+def png_sink(monkeypatch):
+    sink = _PngSink()
+    monkeypatch.setattr(vision_capture, "open", sink.open, raising=False)
+    return sink
+
+
+def _write_png(path, sink=None):
+    if sink is not None:
+        sink.write(_PNG_MAGIC)
+        return
+    with open(path, "wb") as handle:
+        handle.write(_PNG_MAGIC)
+
+
+class DummyCmdOk:
+    def __init__(self, sink=None):
         self.calls = []
+        self.sink = sink
 
     def get_viewport(self, output=0, quiet=1):
         return [800, 400]
 
     def png(self, path, width=0, height=0, ray=0, quiet=1, prior=0):
         self.calls.append((width, height, prior))
-        with open(path, "wb") as handle:
-            handle.write(b"\x89PNG\r\n\x1a\n")
+        _write_png(path, self.sink)
 
 
 class DummyCmdFail:
@@ -20,8 +60,9 @@ class DummyCmdFail:
 
 
 class DummyCmdPriorFail:
-    def __init__(self):
+    def __init__(self, sink=None):
         self.calls = []
+        self.sink = sink
 
     def get_viewport(self, output=0, quiet=1):
         return [640, 480]
@@ -29,34 +70,46 @@ class DummyCmdPriorFail:
     def png(self, path, width=0, height=0, ray=0, quiet=1, prior=0):
         self.calls.append((width, height, prior))
         if prior == 1:
+            # Leave a partial image behind; the fallback render must replace it.
+            if self.sink is not None:
+                self.sink.write(_PNG_MAGIC + b"partial image data")
             raise RuntimeError("no prior image")
-        with open(path, "wb") as handle:
-            handle.write(b"\x89PNG\r\n\x1a\n")
+        _write_png(path, self.sink)
 
 
-def test_capture_success_data_url():
-    cmd = DummyCmdOk()
+@pytest.mark.parametrize("cmd_factory, expected_calls", [(DummyCmdOk, 1), (DummyCmdPriorFail, 2)])
+def test_capture_success_data_url(cmd_factory, expected_calls, png_sink):
+    cmd = cmd_factory(png_sink)
+    width, height = cmd.get_viewport()
     result = capture_viewer_snapshot(cmd, width=100, height=0)
     assert result["ok"] is True
-    assert result["image_data_url"].startswith("data:image/png;base64,")
-    assert result["meta"]["bytes"] > 0
-    assert result["meta"]["width"] == 800
-    assert result["meta"]["height"] == 400
+    assert result["image_data_url"] == "data:image/png;base64," + base64.b64encode(_PNG_MAGIC).decode("ascii")
+    assert result["meta"]["bytes"] == len(_PNG_MAGIC)
+    assert result["meta"]["width"] == width
+    assert result["meta"]["height"] == height
     assert result["meta"]["requested_width"] == 100
     assert result["meta"]["requested_height"] == 0
-    assert cmd.calls[0] == (0, 0, 1)
-
-
-def test_capture_prior_fallback_to_render():
-    cmd = DummyCmdPriorFail()
-    result = capture_viewer_snapshot(cmd, width=100, height=0)
-    assert result["ok"] is True
-    assert len(cmd.calls) == 2
-    assert cmd.calls[0] == (0, 0, 1)
-    assert cmd.calls[1] == (0, 0, 0)
+    # The prior image is tried first; a fresh render is only the fallback.
+    assert cmd.calls == [(0, 0, 1), (0, 0, 0)][:expected_calls]
 
 
 def test_capture_failure_shape():
-    result = capture_viewer_snapshot(DummyCmdFail(), width=100, height=0)
+    result = capture_viewer_snapshot(DummyCmdFail(), width=100, height=0, encode=False)
     assert result["ok"] is False
     assert "error" in result
+
+
+def test_capture_renders_through_call_in_gui():
+    cmd = DummyCmdOk()
+    gui_calls = []
+
+    def call_in_gui(fn):
+        gui_calls.append(fn)
+        return fn()
+
+    result = capture_viewer_snapshot(cmd, width=100, height=0, call_in_gui=call_in_gui, encode=False)
+    assert result["ok"] is True
+    assert result["image_data_url"] == ""
+    assert result["meta"]["bytes_data"] == _PNG_MAGIC
+    assert len(gui_calls) == 1
+    assert cmd.calls == [(0, 0, 1)]
@@ -19,7 +19,7 @@ def func2(a: bool, b: bool):
 def test_bool(capsys):
     cmd.do("func2 yes, 0")
     out, err = capsys.readouterr()
-    assert out == '' and err == ''
+    assert not out and not err
 
 @cmd.new_command
 def func3(
@@ -38,7 +38,7 @@ def func3(
 def test_generic(capsys):
     cmd.do("func3 nullable_point=1 2 3, my_foo=11.0")
     out, err = capsys.readouterr()
-    assert out + err == ''
+    assert not out and not err
 
 @cmd.new_command
 def func4(dirname: Path = Path('.')):
@@ -48,7 +48,7 @@ def test_path(capsys):
     cmd.do('func4 ..')
     cmd.do('func4')
     out, err = capsys.readouterr()
-    assert out + err == ''
+    assert not out and not err
 
 @cmd.new_command
 def func5(old_style: Any):
@@ -72,12 +72,9 @@ def func7(a: List[int]):
 
 def test_list(capsys):
     cmd.do("func6 1 2 3")
-    out, err = capsys.readouterr()
-    assert out + err == ''
-
     cmd.do("func7 1 2 3")
     out, err = capsys.readouterr()
-    assert out + err == ''
+    assert not out and not err
 
 @cmd.new_command
 def func8(a: Tuple[str, int]):
@@ -86,7 +83,7 @@ def func8(a: Tuple[str, int]):
 def test_tuple(capsys):
     cmd.do("func8 fooo 42")
     out, err = capsys.readouterr()
-    assert out + err == ''
+    assert not out and not err
 
 @cmd.new_command
 def func10(a: str="sele"):
@@ -95,7 +92,7 @@ def func10(a: str="sele"):
 def test_default(capsys):
     cmd.do('func10')
     out, err = capsys.readouterr()
-    assert out + err == ''
+    assert not out and not err
 
 @mark.skipif(
     sys.version_info < (3, 11),
@@ -123,3 +123,14 @@ def test_rebuild(sc: Shortcut):
 
     assert "com" == sc.interpret("com")
     assert "com_xxx" == sc.interpret("c_x")
+
+
+def test_interpret_prefix_results_are_cached_and_invalidated(sc: Shortcut):
+    first = sc.interpret("c")
+    first.append("mutated")
+    assert ["com", "com_bla", "com_xxx"] == sorted(sc.interpret("c"))
+    assert "c" in sc._prefix_cache
+
+    sc.append("cat")
+    assert "c" not in sc._prefix_cache
+    assert ["cat", "com", "com_bla", "com_xxx"] == sorted(sc.interpret("c"))